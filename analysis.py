@@ -4,6 +4,8 @@ from PIL import Image
 import requests
 import PyPDF2
 
+from repair_estimate import estimate_frame, estimate_repair, estimate_text
+
 api_key = st.secrets["IBM_API_KEY"]
 project_id = st.secrets["PROJECT_ID"]
 
@@ -91,6 +93,10 @@ def main():
     if "uploaded_doc" not in st.session_state:
         st.session_state.uploaded_doc = False
 
+    #line items as JSON, checked and added up locally, instead of a prose answer
+    itemized = st.toggle("Itemized estimate", help="Parts and labor per item with computed totals; "
+                                                   "a photo that was already estimated isn't sent again")
+
     #the first UI seen to interface/add files
     uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "jpeg", "png"])
 
@@ -166,13 +172,37 @@ def main():
             #loading screen until the code computes from the query model
                 #where the query function is just sending the message with the authorization we have
             with st.spinner("Analyzing..."):
-                ai_response = query_model([system_prompt])
+                ai_response = None
+                #the line items belong to the previous analysis, whether or not this one succeeds
+                st.session_state.pop("estimate", None)
+                if itemized:
+                    try:
+                        st.session_state.estimate = estimate_repair(uploaded_file.getvalue(), query_model,
+                                                                    mime=uploaded_file.type)
+                        ai_response = estimate_text(st.session_state.estimate)
+                    except ValueError as e:
+                        st.session_state.estimate_error = str(e)
+                else:
+                    ai_response = query_model([system_prompt])
 
             #then, it just adds the message it develops as the response written from the "assistant", not "user", role 
-            st.session_state.messages.append({"role": "assistant", "content": ai_response})
+            if ai_response is not None:
+                st.session_state.messages.append({"role": "assistant", "content": ai_response})
 
             st.session_state.image_analyzed = True
 
+        #a failed estimate is marked analyzed too, so reruns don't keep calling the model;
+        #it's only asked again when the user says so
+        if st.session_state.get("estimate_error"):
+            st.error(f"The model's estimate couldn't be read. ({st.session_state.estimate_error})")
+            if st.button("Try again"):
+                st.session_state.estimate_error = None
+                st.session_state.image_analyzed = False
+                st.rerun()
+
+    if st.session_state.get("estimate"):
+        st.dataframe(estimate_frame(st.session_state.estimate), hide_index=True)
+
     #keeping the previous chat history 
     for msg in st.session_state.messages[1:]:
         if msg['role'] == "user":
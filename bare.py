@@ -4,6 +4,8 @@ from PIL import Image
 import requests
 import PyPDF2
 
+from repair_estimate import estimate_frame, estimate_repair, estimate_text
+
 api_key = st.secrets["IBM_API_KEY"]
 project_id = st.secrets["PROJECT_ID"]
 
@@ -82,6 +84,9 @@ def main():
         st.subheader("Document Preview")
         st.write(text_preview[:1000] + ("..." if len(text_preview) > 1000 else ""))
 
+    #line items as JSON, checked and added up locally, instead of a prose answer
+    itemized = st.toggle("Itemized estimate", help="Parts and labor per item with computed totals; "
+                                                   "a photo that was already estimated isn't sent again")
     analyze_button = st.button("Analyze")
 
     if analyze_button:
@@ -95,9 +100,20 @@ def main():
                     {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
                 ]
             }
+            estimate = None
             with st.spinner("Analyzing image..."):
-                ai_response = query_model([system_prompt])
+                if itemized:
+                    try:
+                        estimate = estimate_repair(uploaded_image.getvalue(), query_model, mime=uploaded_image.type)
+                    except ValueError as e:
+                        st.error(f"The model's estimate couldn't be read, please try again. ({e})")
+                        st.stop()
+                    ai_response = estimate_text(estimate)
+                else:
+                    ai_response = query_model([system_prompt])
             st.subheader("Analysis Result")
+            if estimate:
+                st.dataframe(estimate_frame(estimate), hide_index=True)
             st.write(ai_response)
         elif doc_uploaded and not file_uploaded:
             #doc analysis
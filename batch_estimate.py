@@ -0,0 +1,357 @@
+# Itemized repair estimates for a whole directory of damage photos
+#photos are shrunk to JPEG in a pool of worker processes, handed over through a
+#bounded queue (so preprocessing never runs far ahead of the model) to threads
+#that make the model calls under a shared rate limit, and every result is written
+#to JSONL or Parquet as soon as it's in (Parquet a part file per FLUSH_ROWS
+#results, merged into the output at the end). Photos already in the output are
+#skipped on a rerun, and estimates are kept in repair_estimate's store, so an
+#interrupted job picks up where it stopped
+#
+#usage: python batch_estimate.py claims/2026-10-19/ --output estimates.jsonl
+#       python batch_estimate.py manifest.csv --output estimates.parquet --workers 8 --rpm 120
+#
+#a manifest is a text file with one image path per line, or a CSV with a `path`
+#column; relative paths are taken from the manifest's directory
+
+import argparse
+import io
+import json
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from PIL import Image, ImageOps
+
+from model_client import SECRETS_PATH, ModelClient, load_credentials
+from rate_limit import RateLimiter
+from repair_estimate import ESTIMATE_SCOPE, STORE_PATH, estimate_repair, image_hash
+from script_tools import progress_printer
+
+IMAGE_TYPES = (".jpg", ".jpeg", ".png")
+#longest side sent to the model; bigger photos only cost upload time and tokens
+MAX_SIDE = 1568
+JPEG_QUALITY = 85
+MAX_WORKERS = 4
+MAX_PREPROCESS_WORKERS = 4
+REQUESTS_PER_MINUTE = 60
+PROGRESS_LINE = "estimated {done:,} / {total:,} photos ({rate:,.2f} photos/s)"
+#Parquet part files are written every this many results
+FLUSH_ROWS = 100
+SCHEMA = pa.schema([
+    ("path", pa.string()),
+    ("image_hash", pa.string()),
+    ("status", pa.string()),
+    ("error", pa.string()),
+    ("parts", pa.float64()),
+    ("labor", pa.float64()),
+    ("total", pa.float64()),
+    #the line items and damages as JSON text in Parquet, plain lists in JSONL
+    ("items", pa.string()),
+    ("damages", pa.string()),
+    ("notes", pa.string()),
+    ("seconds", pa.float64()),
+])
+
+
+# Inputs
+def list_images(source):
+    if os.path.isdir(source):
+        paths = [os.path.join(root, name) for root, _, names in os.walk(source)
+                 for name in names if name.lower().endswith(IMAGE_TYPES)]
+        return sorted(os.path.normpath(path) for path in paths)
+    base = os.path.dirname(source)
+    if source.lower().endswith(".csv"):
+        paths = pd.read_csv(source)["path"].dropna().astype(str).tolist()
+    else:
+        with open(source, "r", encoding="utf-8") as f:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return [os.path.normpath(os.path.join(base, path)) for path in paths]
+
+
+#run in a worker process: the hash of the file as it is on disk, the same key the
+#apps store an uploaded photo's estimate under, and the photo upright, RGB, at
+#most MAX_SIDE pixels, as JPEG bytes for the model
+def prepare_image(path, max_side=MAX_SIDE, quality=JPEG_QUALITY):
+    try:
+        with open(path, "rb") as f:
+            key = image_hash(f.read())
+            f.seek(0)
+            with Image.open(f) as picture:
+                picture = ImageOps.exif_transpose(picture).convert("RGB")
+                picture.thumbnail((max_side, max_side))
+                out = io.BytesIO()
+                picture.save(out, "JPEG", quality=quality)
+        return path, key, out.getvalue(), None
+    except (OSError, ValueError) as e:
+        return path, None, None, f"couldn't read the image: {e}"
+
+
+# Output
+#row groups of a Parquet run that hasn't been closed yet, each its own file, so
+#they survive the process being killed
+def part_paths(output):
+    parts = f"{output}.parts"
+    if not os.path.isdir(parts):
+        return []
+    return sorted(os.path.join(parts, name) for name in os.listdir(parts) if name.endswith(".parquet"))
+
+
+def read_results(output):
+    if output.lower().endswith(".parquet"):
+        paths = ([output] if os.path.exists(output) else []) + part_paths(output)
+        if not paths:
+            return pd.DataFrame(columns=SCHEMA.names)
+        return pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)
+    if not os.path.exists(output):
+        return pd.DataFrame(columns=SCHEMA.names)
+    with open(output, "r", encoding="utf-8") as f:
+        #a line cut off by an interrupted run is skipped, that photo is redone
+        rows = []
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                pass
+    return pd.DataFrame(rows, columns=SCHEMA.names)
+
+
+#photos with a finished estimate in the output; failed ones are tried again
+def done_paths(output):
+    results = read_results(output)
+    return set(results.loc[results["status"] == "ok", "path"])
+
+
+#appends results as they arrive: JSONL line by line, Parquet a row group at a time
+#into part files next to the output. close() merges the earlier results and the
+#parts into the output; after a crash the parts are picked up by the next run
+class ResultWriter:
+    def __init__(self, output, resume=True):
+        self.output = output
+        self.parquet = output.lower().endswith(".parquet")
+        self.lock = threading.Lock()
+        self.pending = []
+        self.closed = False
+        if self.parquet:
+            self.parts = f"{output}.parts"
+            if not resume:
+                shutil.rmtree(self.parts, ignore_errors=True)
+            self.previous = ([output] if resume and os.path.exists(output) else []) + part_paths(output)
+            self.written = []
+            os.makedirs(self.parts, exist_ok=True)
+        else:
+            #a cut-off last line would swallow the next result
+            if resume and os.path.exists(output) and os.path.getsize(output):
+                with open(output, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    ends_cleanly = f.read(1) == b"\n"
+            else:
+                ends_cleanly = True
+            self.file = open(output, "a" if resume else "w", encoding="utf-8")
+            if not ends_cleanly:
+                self.file.write("\n")
+
+    #results still arriving after close (an interrupted run) are dropped
+    def write(self, row):
+        with self.lock:
+            if self.closed:
+                return
+            if not self.parquet:
+                self.file.write(json.dumps(row) + "\n")
+                self.file.flush()
+                return
+            self.pending.append(dict(row, items=json.dumps(row["items"]), damages=json.dumps(row["damages"])))
+            if len(self.pending) >= FLUSH_ROWS:
+                self.flush()
+
+    def flush(self):
+        if self.pending:
+            #numbered after the parts left by earlier runs; written under a temporary
+            #name so a half-written part is never read back
+            path = os.path.join(self.parts, f"part-{len(self.previous) + len(self.written):06d}.parquet")
+            pq.write_table(pa.Table.from_pylist(self.pending, schema=SCHEMA), f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+            self.written.append(path)
+            self.pending = []
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if not self.parquet:
+                self.file.close()
+                return
+            self.flush()
+            tmp_path = f"{self.output}.tmp"
+            with pq.ParquetWriter(tmp_path, SCHEMA) as writer:
+                #failed photos of earlier runs were tried again in this one
+                for path in self.previous:
+                    previous = pd.read_parquet(path)
+                    kept = previous[previous["status"] == "ok"]
+                    if len(kept):
+                        writer.write_table(pa.Table.from_pandas(kept, schema=SCHEMA, preserve_index=False))
+                for path in self.written:
+                    writer.write_table(pq.read_table(path, schema=SCHEMA))
+            os.replace(tmp_path, self.output)
+            shutil.rmtree(self.parts, ignore_errors=True)
+
+
+def result_row(path, key, estimate=None, error=None, seconds=0.0):
+    totals = estimate["totals"] if estimate else {}
+    return {
+        "path": path,
+        "image_hash": key,
+        "status": "ok" if estimate else "error",
+        "error": error,
+        "parts": totals.get("parts"),
+        "labor": totals.get("labor"),
+        "total": totals.get("total"),
+        "items": estimate["items"] if estimate else [],
+        "damages": estimate.get("damages", []) if estimate else [],
+        "notes": estimate.get("notes") if estimate else None,
+        "seconds": round(seconds, 3),
+    }
+
+
+# Pipeline
+#estimates every photo not already in `output`; returns counts and timings for the summary.
+#At most `queue_size` preprocessed photos wait for a model thread, and at most as many
+#again are being preprocessed, so memory stays flat however many photos there are
+def estimate_images(paths, query_fn, output, max_workers=MAX_WORKERS, requests_per_minute=REQUESTS_PER_MINUTE,
+                    queue_size=None, preprocess_workers=MAX_PREPROCESS_WORKERS, max_side=MAX_SIDE,
+                    scope=ESTIMATE_SCOPE, store_path=STORE_PATH, resume=True, progress=None):
+    done = done_paths(output) if resume else set()
+    todo = [path for path in paths if path not in done]
+    queue_size = queue_size or 2 * max_workers
+    limiter = RateLimiter(requests_per_minute)
+    local = threading.local()
+    stats = {"images": len(paths), "skipped": len(paths) - len(todo), "ok": 0, "failed": 0,
+             "reused": 0, "calls": 0, "seconds": []}
+    lock = threading.Lock()
+
+    def limited_query(messages):
+        limiter.wait()
+        local.calls += 1
+        with lock:
+            stats["calls"] += 1
+        return query_fn(messages)
+
+    writer = ResultWriter(output, resume)
+    jobs = queue.Queue(maxsize=queue_size)
+
+    def work():
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            path, key, data, error = job
+            started = time.monotonic()
+            local.calls = 0
+            estimate = None
+            #whatever goes wrong only fails this photo: a thread that died here would
+            #never take its sentinel, and the last jobs.put(None) would wait forever
+            try:
+                if data is not None:
+                    estimate = estimate_repair(data, limited_query, mime="image/jpeg", scope=scope,
+                                               store_path=store_path, key=key)
+                row = result_row(path, key, estimate, error, time.monotonic() - started)
+            except Exception as e:
+                estimate = None
+                row = result_row(path, key, None, str(e), time.monotonic() - started)
+            try:
+                writer.write(row)
+            except Exception as e:
+                #not in the output, so it's tried again on the next run
+                estimate = None
+                print(f"\ncouldn't write the result for {path}: {e}", file=sys.stderr)
+            seconds = row["seconds"]
+            with lock:
+                stats["ok" if estimate else "failed"] += 1
+                stats["reused"] += bool(estimate) and local.calls == 0
+                stats["seconds"].append(seconds)
+                finished = stats["ok"] + stats["failed"]
+            if progress:
+                progress(finished, len(todo))
+
+    #daemon threads, so Ctrl-C doesn't wait for calls already in flight
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(max_workers)]
+    for thread in threads:
+        thread.start()
+    workers = min(preprocess_workers, os.cpu_count() or 1)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            window = deque()
+            for path in todo:
+                window.append(pool.submit(prepare_image, path, max_side))
+                if len(window) >= queue_size:
+                    jobs.put(window.popleft().result())
+            while window:
+                jobs.put(window.popleft().result())
+        for _ in threads:
+            jobs.put(None)
+        for thread in threads:
+            thread.join()
+    finally:
+        writer.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Itemized repair estimates for every photo in a directory or manifest.")
+    parser.add_argument("source", help="directory of .jpg/.png photos, or a manifest (.txt or .csv with a path column)")
+    parser.add_argument("--output", default="estimates.jsonl", help="JSONL or Parquet file to write")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="model calls in flight at once")
+    parser.add_argument("--rpm", type=float, default=REQUESTS_PER_MINUTE, help="model requests per minute")
+    parser.add_argument("--queue", type=int, help="preprocessed photos waiting for the model (default: 2 x workers)")
+    parser.add_argument("--preprocess-workers", type=int, default=MAX_PREPROCESS_WORKERS,
+                        help="processes resizing photos")
+    parser.add_argument("--max-side", type=int, default=MAX_SIDE, help="longest side in pixels sent to the model")
+    parser.add_argument("--restart", action="store_true", help="ignore earlier results in the output and start over")
+    parser.add_argument("--store", default=STORE_PATH, help="estimate store used for checkpoints and reuse")
+    parser.add_argument("--secrets", default=SECRETS_PATH, help="secrets.toml to read credentials from")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        parser.error(f"no such directory or manifest: {args.source}")
+    paths = list_images(args.source)
+    if not paths:
+        parser.error(f"no .jpg or .png photos found in {args.source}")
+    try:
+        client = ModelClient(*load_credentials(args.secrets))
+    except RuntimeError as e:
+        parser.error(str(e))
+    print(f"{len(paths):,} photos", file=sys.stderr)
+
+    started = time.time()
+    try:
+        stats = estimate_images(
+            paths, lambda messages: client(messages, max_tokens=900), args.output, max_workers=args.workers,
+            requests_per_minute=args.rpm, queue_size=args.queue, preprocess_workers=args.preprocess_workers,
+            max_side=args.max_side, store_path=args.store, resume=not args.restart,
+            progress=progress_printer(started, PROGRESS_LINE),
+        )
+    except KeyboardInterrupt:
+        print(f"\ninterrupted after {client.calls:,} model calls; finished photos are in {args.output} "
+              f"and {args.store}, rerun the same command to resume", file=sys.stderr)
+        sys.exit(130)
+    elapsed = time.time() - started
+    print(file=sys.stderr)
+
+    processed = stats["ok"] + stats["failed"]
+    print(f"wrote {processed:,} results to {args.output}, skipped {stats['skipped']:,} already done")
+    print(f"{stats['ok']:,} estimated ({stats['reused']:,} reused from the store), {stats['failed']:,} failed")
+    print(f"{stats['calls']:,} model calls in {elapsed:.1f}s, {processed / max(elapsed, 1e-9):,.2f} photos/s")
+    if stats["seconds"]:
+        seconds = np.array(stats["seconds"])
+        print(f"p50 {np.percentile(seconds, 50):.2f}s, p95 {np.percentile(seconds, 95):.2f}s per photo")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,24 +3,17 @@ import base64
 from PIL import Image
 import requests
 import PyPDF2
+from datetime import datetime
 
-from io import BytesIO
-from fpdf import FPDF
+from report_batch import FORMATS, export_reports
+from repair_estimate import estimate_frame, estimate_repair, estimate_text
+from report_pdf import create_pdf, start_report
 
 api_key = st.secrets["IBM_API_KEY"]
 project_id = st.secrets["PROJECT_ID"]
 
-def create_pdf(content, title="Analysis Result"):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Times", size=12)
-    pdf.cell(200, 10, txt=title, ln=True, align="C")
-    pdf.ln(10)
-    for line in content.split('\n'):
-        pdf.multi_cell(0, 10, line)
-    pdf_bytes = pdf.output(dest='S').encode('latin1') 
-    return BytesIO(pdf_bytes)
-
+#analyses kept for the batch export, oldest dropped first
+MAX_HISTORY = 100
 
 def convert_image_to_base64(uploaded_file):
     bytes_data = uploaded_file.getvalue()
@@ -78,6 +71,14 @@ def query_model(messages):
         raise Exception(f"Non-200 response: {response.text}")
     return response.json()['choices'][0]['message']['content']
 
+#kept in the session for the batch export
+def remember_analysis(item):
+    item["title"] = f"{item['title']} ({datetime.now():%Y-%m-%d %H:%M})"
+    history = st.session_state.setdefault("history", [])
+    history.append(item)
+    del history[:-MAX_HISTORY]
+
+
 def main():
     st.title("Analyze Image or Document Streamlit Web Application")
 
@@ -97,6 +98,9 @@ def main():
         st.subheader("Document Preview")
         st.write(text_preview[:1000] + ("..." if len(text_preview) > 1000 else ""))
 
+    #line items as JSON, checked and added up locally, instead of a prose answer
+    itemized = st.toggle("Itemized estimate", help="Parts and labor per item with computed totals; "
+                                                   "a photo that was already estimated isn't sent again")
     analyze_button = st.button("Analyze")
 
     if "ai_response" not in st.session_state:
@@ -114,12 +118,29 @@ def main():
                     {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
                 ]
             }
+            estimate = None
             with st.spinner("Analyzing image..."):
-                ai_response = query_model([system_prompt])
+                if itemized:
+                    try:
+                        estimate = estimate_repair(uploaded_image.getvalue(), query_model, mime=uploaded_image.type)
+                    except ValueError as e:
+                        st.error(f"The model's estimate couldn't be read, please try again. ({e})")
+                        st.stop()
+                    ai_response = estimate_text(estimate)
+                else:
+                    ai_response = query_model([system_prompt])
 
             st.session_state["ai_response"] = ai_response
+            #the report shows a thumbnail of the analyzed photo
+            st.session_state["report_image"] = uploaded_image.getvalue()
+            #the PDF renders in the background while the result is shown
+            start_report(ai_response, image=st.session_state["report_image"])
+            remember_analysis({"title": f"Image analysis: {uploaded_image.name}", "content": ai_response,
+                               "image": st.session_state["report_image"]})
 
             st.subheader("Analysis Result")
+            if estimate:
+                st.dataframe(estimate_frame(estimate), hide_index=True)
             st.write(ai_response)
         elif doc_uploaded and not file_uploaded:
             #doc analysis
@@ -135,6 +156,10 @@ def main():
                 ai_response = query_model([system_prompt])
 
             st.session_state["ai_response"] = ai_response
+            st.session_state["report_image"] = None
+            #the PDF renders in the background while the result is shown
+            start_report(ai_response)
+            remember_analysis({"title": f"Document analysis: {uploaded_doc.name}", "content": ai_response})
 
             st.subheader("Analysis Result")
             st.write(ai_response)
@@ -145,7 +170,8 @@ def main():
 
     #only add the button if the repsonse is creatred from the interface in the first plcae
     if st.session_state.get("ai_response"):
-        pdf_bytes = create_pdf(st.session_state["ai_response"])
+        #built once per distinct response, reruns get the same bytes back
+        pdf_bytes = create_pdf(st.session_state["ai_response"], image=st.session_state.get("report_image"))
         st.download_button(
             label="Download Output",
             data=pdf_bytes,
@@ -153,5 +179,17 @@ def main():
             mime="application/pdf"
         )
 
+    #every analysis of this session in one download, rendered only when asked for
+    history = st.session_state.get("history", [])
+    if len(history) > 1:
+        with st.expander(f"Export all {len(history)} analyses"):
+            fmt = st.radio("Format", list(FORMATS), horizontal=True,
+                           format_func=lambda f: "One PDF" if f == "pdf" else "ZIP of PDFs")
+            if st.button("Prepare export"):
+                with st.spinner(f"Rendering {len(history)} reports..."):
+                    with export_reports(history, fmt) as export:
+                        st.download_button("Download export", data=export, file_name=f"analyses.{fmt}",
+                                           mime=FORMATS[fmt], on_click="ignore")
+
 if __name__ == "__main__":
     main()
@@ -1,67 +1,74 @@
 import streamlit as st
 import pandas as pd
-import altair as alt
-import json
-import os
+import time
 from datetime import datetime
 
+from elo_core import (
+    DEFAULT_LEAGUE, build_elo_chart, build_leaderboard, clear_league, create_league, league_mtimes,
+    league_name, list_leagues, load_league, save_league, sort_history, update_ratings,
+)
+from elo_simulation import FORMATS, simulate_tournament, simulate_matchup
+from elo_backtest import DEFAULT_K_VALUES, DEFAULT_OFFSETS, backtest, build_grid, describe
+
 # Constants
-K = 32
-ELO_FILE = "elo_ratings.json"
-MATCH_FILE = "match_history.json"
+PAGE_SIZES = [10, 25, 50, 100]
+SIMULATION_COUNTS = [1000, 5000, 10000, 20000, 50000]
 
-# Clear data function
+# Clear data function, only touches the league being viewed
 def clear_all_data():
+    clear_league(st.session_state.league)
     st.session_state.ratings = {}
     st.session_state.matches = []
-    st.session_state.initialized = False
-    if os.path.exists(ELO_FILE):
-        os.remove(ELO_FILE)
-    if os.path.exists(MATCH_FILE):
-        os.remove(MATCH_FILE)
+    st.session_state.loaded_league = None
 
 
 # Functions for file I/O
-def load_data():
-    if os.path.exists(ELO_FILE):
-        with open(ELO_FILE, "r") as f:
-            st.session_state.ratings = json.load(f)
-    else:
-        st.session_state.ratings = {}
+#shared by every session viewing the same league, and refreshed when its files change
+@st.cache_data(show_spinner=False, max_entries=16)
+def load_league_cached(league, mtimes):
+    return load_league(league)
 
-    if os.path.exists(MATCH_FILE):
-        with open(MATCH_FILE, "r") as f:
-            st.session_state.matches = json.load(f)
-    else:
-        st.session_state.matches = []
+def load_data():
+    league = st.session_state.league
+    st.session_state.ratings, st.session_state.matches = load_league_cached(league, league_mtimes(league))
+    st.session_state.loaded_league = league
+    #views, simulations and backtests belong to the previously loaded data
+    st.session_state.pop("views", None)
+    st.session_state.pop("simulation", None)
+    st.session_state.pop("backtest", None)
 
 def save_data():
-    with open(ELO_FILE, "w") as f:
-        json.dump(st.session_state.ratings, f)
-    with open(MATCH_FILE, "w") as f:
-        json.dump(st.session_state.matches, f)
-
-# Load data once
-if "initialized" not in st.session_state:
+    save_league(st.session_state.league, st.session_state.ratings, st.session_state.matches)
+    #anything derived from the old data has to be rebuilt on the next rerun
+    st.session_state.data_version = st.session_state.get("data_version", 0) + 1
+
+# League selector
+with st.sidebar:
+    st.header("League")
+    if st.session_state.get("new_league"):
+        #select a league created on the previous run before the selectbox is drawn
+        st.session_state.league = st.session_state.pop("new_league")
+    st.selectbox("League", list_leagues(), format_func=league_name, key="league", label_visibility="collapsed")
+    with st.form("league_form", clear_on_submit=True):
+        new_name = st.text_input("New league name")
+        if st.form_submit_button("Add League") and new_name:
+            try:
+                st.session_state.new_league = create_league(new_name)
+                st.rerun()
+            except ValueError as e:
+                st.error(str(e))
+
+# Load only the selected league, and again whenever the selection changes
+if st.session_state.get("loaded_league") != st.session_state.league:
     load_data()
-    st.session_state.initialized = True
 
 # ELO math
-def expected_score(rating_a, rating_b):
-    return 1 / (1 + 10 ** ((rating_b - rating_a) / 400))
-
 def update_elo(winner, loser):
-    rating_winner = st.session_state.ratings.get(winner, 1500)
-    rating_loser = st.session_state.ratings.get(loser, 1500)
-
-    expected_win = expected_score(rating_winner, rating_loser)
-    expected_lose = 1 - expected_win
-
-    st.session_state.ratings[winner] = rating_winner + K * (1 - expected_win)
-    st.session_state.ratings[loser] = rating_loser + K * (0 - expected_lose)
+    update_ratings(st.session_state.ratings, winner, loser)
 
 # UI - Title
-st.title("🏓 Ping Pong ELO Ranking Dashboard")
+icon = "🏓" if st.session_state.league == DEFAULT_LEAGUE else "🏆"
+st.title(f"{icon} {league_name(st.session_state.league)} ELO Ranking Dashboard")
 
 
 # Match input form
@@ -94,61 +101,150 @@ with st.form("match_form"):
         save_data()
         st.success(f"Recorded: {winner} defeated {loser}")
 
-# Create DataFrames
-match_df = pd.DataFrame(st.session_state.matches)
-ratings_df = pd.DataFrame([
-    {"Player": player, "ELO": round(rating, 1)}
-    for player, rating in sorted(st.session_state.ratings.items(), key=lambda x: x[1], reverse=True)
-])
+# Sorted views, cached between reruns until the data changes
+def get_views():
+    version = st.session_state.get("data_version", 0)
+    views = st.session_state.get("views")
+    if views is None or views["version"] != version:
+        ratings_df = build_leaderboard(st.session_state.ratings)
+        match_df = pd.DataFrame(st.session_state.matches)
+        history_df = sort_history(match_df)
+        #the chart replays the whole history, so it's built here rather than on every page click
+        chart = build_elo_chart(match_df) if not match_df.empty else None
+        views = {"version": version, "ratings": ratings_df, "matches": match_df, "history": history_df,
+                 "chart": chart}
+        st.session_state.views = views
+    return views
+
+def search_rows(df, query, columns):
+    if not query:
+        return df
+    mask = pd.Series(False, index=df.index)
+    for column in columns:
+        mask |= df[column].astype(str).str.contains(query, case=False, regex=False)
+    return df[mask]
+
+#only the requested slice ever gets styled or sent to the browser
+#`gradient_range` is the (min, max) of the unfiltered column, so a search doesn't shift the colours
+def show_page(df, key, gradient=None, gradient_range=None):
+    col1, col2 = st.columns(2)
+    with col1:
+        page_size = st.selectbox("Rows per page", PAGE_SIZES, key=f"{key}_page_size")
+    pages = max(1, -(-len(df) // page_size))
+    #a narrower search can leave the remembered page past the end
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+    with col2:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+
+    start = (page - 1) * page_size
+    page_df = df.iloc[start:start + page_size]
+    if gradient and not page_df.empty:
+        #keep colours comparable across pages by using the whole column's range
+        vmin, vmax = gradient_range or (df[gradient].min(), df[gradient].max())
+        st.dataframe(
+            page_df.style.background_gradient(cmap='Blues', subset=[gradient], vmin=vmin, vmax=vmax),
+            use_container_width=True, hide_index=True
+        )
+    else:
+        st.dataframe(page_df, use_container_width=True, hide_index=True)
+    st.caption(f"Showing {len(page_df)} of {len(df)} rows")
+
+views = get_views()
+match_df = views["matches"]
+ratings_df = views["ratings"]
 
 # Show Ranking Table
 st.subheader("🏆 Player Rankings")
-st.dataframe(ratings_df.style.background_gradient(cmap='Blues'), use_container_width=True)
+player_query = st.text_input("Search players", key="ratings_search")
+show_page(search_rows(ratings_df, player_query, ["Player"]), "ratings", gradient="ELO",
+          gradient_range=(ratings_df["ELO"].min(), ratings_df["ELO"].max()))
+
+# Tournament Simulator
+#cached on the ratings themselves, so every session viewing the same league shares results
+@st.cache_data(show_spinner=False, max_entries=20)
+def run_simulation(ratings_items, fmt, n_sims):
+    start = time.perf_counter()
+    results = simulate_tournament(dict(ratings_items), fmt, n_sims, seed=0)
+    return results, time.perf_counter() - start
+
+if len(st.session_state.ratings) >= 2:
+    st.subheader("🎲 Tournament Simulator")
+    with st.form("simulation_form"):
+        col1, col2 = st.columns(2)
+        with col1:
+            sim_format = st.radio("Format", FORMATS, format_func=str.title, horizontal=True)
+        with col2:
+            sim_count = st.select_slider("Simulated tournaments", options=SIMULATION_COUNTS, value=10000)
+        if st.form_submit_button("Run Simulation"):
+            st.session_state.simulation = {"format": sim_format, "count": sim_count}
+
+    simulation = st.session_state.get("simulation")
+    if simulation:
+        ratings_items = tuple(sorted(st.session_state.ratings.items()))
+        with st.spinner("Simulating tournaments..."):
+            sim_df, elapsed = run_simulation(ratings_items, simulation["format"], simulation["count"])
+        st.caption(
+            f"{simulation['count']:,} simulated {simulation['format']} tournaments in {elapsed:.2f}s, "
+            "with 95% intervals for win chance and expected rank"
+        )
+        show_page(sim_df.round(2), "simulation", gradient="Win %")
+
+    st.markdown("**Head-to-head**")
+    players = sorted(st.session_state.ratings)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        player_a = st.selectbox("Player A", players, key="matchup_a")
+    with col2:
+        player_b = st.selectbox("Player B", players, index=1, key="matchup_b")
+    with col3:
+        best_of = st.selectbox("Best of", [1, 3, 5, 7], key="matchup_best_of")
+    if player_a != player_b:
+        win, low, high = simulate_matchup(
+            st.session_state.ratings[player_a], st.session_state.ratings[player_b], best_of, seed=0
+        )
+        st.write(f"{player_a} wins a best-of-{best_of} against {player_b} **{win:.1%}** of the time ({low:.1%}–{high:.1%})")
 
 # ELO Over Time Visualization
 if not match_df.empty:
     st.subheader("📈 ELO Over Time")
 
-    elo_history = {}
-    temp_ratings = {}
-
-    history_records = []
-
-    for _, row in match_df.sort_values("date").iterrows():
-        p1, p2, winner = row["player1"], row["player2"], row["winner"]
-        loser = p2 if winner == p1 else p1
-
-        for player in [p1, p2]:
-            temp_ratings.setdefault(player, 1500)
-
-        expected_win = expected_score(temp_ratings[winner], temp_ratings[loser])
-        expected_lose = 1 - expected_win
-
-        temp_ratings[winner] += K * (1 - expected_win)
-        temp_ratings[loser] += K * (0 - expected_lose)
-
-        for player in [p1, p2]:
-            history_records.append({
-                "date": pd.to_datetime(row["date"]),
-                "player": player,
-                "elo": temp_ratings[player]
-            })
-
-    elo_df = pd.DataFrame(history_records)
-    chart = alt.Chart(elo_df).mark_line().encode(
-        x='date:T',
-        y='elo:Q',
-        color='player:N'
-    ).properties(width=700, height=400)
-
-    st.altair_chart(chart, use_container_width=True)
+    st.altair_chart(views["chart"], use_container_width=True)
 
 # Match History Table
 if not match_df.empty:
     st.subheader("📜 Match History")
-    st.dataframe(match_df.sort_values("date", ascending=False), use_container_width=True)
+    match_query = st.text_input("Search matches", key="matches_search")
+    show_page(search_rows(views["history"], match_query, ["player1", "player2", "winner", "date"]), "matches")
+
+# Rating settings backtest
+@st.cache_data(show_spinner=False, max_entries=4)
+def run_backtest(matches, include_glicko):
+    grid = build_grid(DEFAULT_K_VALUES, DEFAULT_OFFSETS, glicko=include_glicko)
+    return backtest(matches, grid)
 
-if st.button("Clear All", type="primary"):
+if not match_df.empty:
+    with st.expander("🧪 Tune Rating Settings"):
+        st.caption("Replays the match history under many K-factors and newcomer ratings and scores each by how well it predicted the next match (lower log-loss is better).")
+        include_glicko = st.checkbox("Include Glicko-style rating deviation")
+        if st.button("Run Backtest"):
+            with st.spinner("Replaying match history..."):
+                backtest_df, backtest_stats = run_backtest(st.session_state.matches, include_glicko)
+            #kept until the matches or the settings change, so the table survives reruns from other widgets
+            st.session_state.backtest = {
+                "version": st.session_state.get("data_version", 0), "glicko": include_glicko,
+                "df": backtest_df, "stats": backtest_stats,
+            }
+
+        result = st.session_state.get("backtest")
+        if result and result["version"] == st.session_state.get("data_version", 0) and result["glicko"] == include_glicko:
+            backtest_df, backtest_stats = result["df"], result["stats"]
+            best = backtest_df.iloc[0]
+            st.success(f"Best: {describe(best)} (log-loss {best['log_loss']:.4f})")
+            st.caption(f"{backtest_stats['configs']} settings x {backtest_stats['matches']} matches replayed in {backtest_stats['seconds']:.2f}s")
+            st.dataframe(backtest_df.head(20), use_container_width=True, hide_index=True)
+
+if st.button(f"Clear {league_name(st.session_state.league)}", type="primary"):
     clear_all_data()
-    st.success("All data cleared! Reloading...")
+    st.success("League data cleared! Reloading...")
     st.rerun()
\ No newline at end of file
@@ -0,0 +1,174 @@
+# Backtests rating settings against the recorded match history
+#every configuration is replayed side by side: one pass over the matches,
+#with each config's ratings held in one row of a numpy array
+#
+#usage: python elo_backtest.py match_history.json --k 16 24 32 40 --offset -100 0 --glicko
+
+import argparse
+import itertools
+import json
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from elo_core import K, START_RATING
+
+Q = math.log(10) / 400
+DEFAULT_K_VALUES = [8, 16, 24, 32, 40, 48, 64]
+DEFAULT_OFFSETS = [-200, -100, 0, 100]
+DEFAULT_RDS = [150, 250, 350]
+DEFAULT_RD_GROWTH = [0, 10, 25]
+#keeps a confident wrong prediction from producing an infinite loss
+EPS = 1e-12
+
+
+#matches replay in date order, ties keep the order they were recorded in
+def encode_matches(matches):
+    match_df = pd.DataFrame(matches)
+    match_df = match_df.sort_values("date", kind="stable")
+    winners = match_df["winner"].to_numpy()
+    losers = np.where(winners == match_df["player1"].to_numpy(), match_df["player2"].to_numpy(), match_df["player1"].to_numpy())
+    codes, players = pd.factorize(np.concatenate([winners, losers]))
+    return codes[:len(winners)], codes[len(winners):], list(players)
+
+
+def build_grid(k_values, offsets, glicko=False, rds=DEFAULT_RDS, rd_growth=DEFAULT_RD_GROWTH):
+    configs = [{"model": "elo", "k": k, "offset": offset, "rd": None, "rd_growth": None}
+               for k, offset in itertools.product(k_values, offsets)]
+    if glicko:
+        configs += [{"model": "glicko", "k": None, "offset": offset, "rd": rd, "rd_growth": growth}
+                    for rd, growth, offset in itertools.product(rds, rd_growth, offsets)]
+    return pd.DataFrame(configs)
+
+
+def g(rd):
+    return 1 / np.sqrt(1 + 3 * Q ** 2 * rd ** 2 / math.pi ** 2)
+
+
+#replays the history once for every row of `grid` and scores each one by the
+#log-loss of its prediction for the next match, made before that match is applied.
+#newcomers join at the current pool average plus `offset` (with a flat start
+#rating the absolute value cancels out of every prediction, the offset does not)
+def backtest(matches, grid, burn_in=0):
+    winners, losers, players = encode_matches(matches)
+    n_matches, n_players = len(winners), len(players)
+
+    is_elo = (grid["model"] == "elo").to_numpy()
+    elo_k = grid.loc[is_elo, "k"].to_numpy(dtype=np.float64)
+    elo_offset = grid.loc[is_elo, "offset"].to_numpy(dtype=np.float64)
+    gl_rd0 = grid.loc[~is_elo, "rd"].to_numpy(dtype=np.float64)
+    gl_growth = grid.loc[~is_elo, "rd_growth"].to_numpy(dtype=np.float64) ** 2
+    gl_offset = grid.loc[~is_elo, "offset"].to_numpy(dtype=np.float64)
+
+    elo = np.full((len(elo_k), n_players), float(START_RATING))
+    rating = np.full((len(gl_rd0), n_players), float(START_RATING))
+    rd = np.repeat(gl_rd0[:, None], n_players, axis=1)
+    elo_loss = np.zeros(len(elo_k))
+    gl_loss = np.zeros(len(gl_rd0))
+    elo_sum = np.zeros(len(elo_k))
+    gl_sum = np.zeros(len(gl_rd0))
+    seen = np.zeros(n_players, dtype=bool)
+    n_seen = 0
+    scored = 0
+
+    start = time.perf_counter()
+    for m in range(n_matches):
+        w, l = winners[m], losers[m]
+        for p in (w, l):
+            if not seen[p]:
+                base = elo_sum / n_seen if n_seen else START_RATING
+                elo[:, p] = base + (elo_offset if n_seen else 0)
+                base = gl_sum / n_seen if n_seen else START_RATING
+                rating[:, p] = base + (gl_offset if n_seen else 0)
+                elo_sum += elo[:, p]
+                gl_sum += rating[:, p]
+                seen[p] = True
+                n_seen += 1
+
+        #elo: predict, score, update (zero-sum, so the pool total is unchanged)
+        expected = 1 / (1 + 10 ** ((elo[:, l] - elo[:, w]) / 400))
+        if m >= burn_in:
+            elo_loss -= np.log(np.maximum(expected, EPS))
+        change = elo_k * (1 - expected)
+        elo[:, w] += change
+        elo[:, l] -= change
+
+        if len(gl_rd0):
+            #glicko-1 with one game per rating period; rd grows by `rd_growth` before every game
+            rd_w = np.minimum(np.sqrt(rd[:, w] ** 2 + gl_growth), gl_rd0)
+            rd_l = np.minimum(np.sqrt(rd[:, l] ** 2 + gl_growth), gl_rd0)
+            diff = rating[:, w] - rating[:, l]
+            predicted = 1 / (1 + 10 ** (-g(np.sqrt(rd_w ** 2 + rd_l ** 2)) * diff / 400))
+            if m >= burn_in:
+                gl_loss -= np.log(np.maximum(predicted, EPS))
+
+            g_l, g_w = g(rd_l), g(rd_w)
+            e_w = 1 / (1 + 10 ** (-g_l * diff / 400))
+            e_l = 1 / (1 + 10 ** (g_w * diff / 400))
+            inv_w = 1 / rd_w ** 2 + Q ** 2 * g_l ** 2 * e_w * (1 - e_w)
+            inv_l = 1 / rd_l ** 2 + Q ** 2 * g_w ** 2 * e_l * (1 - e_l)
+            delta_w = Q / inv_w * g_l * (1 - e_w)
+            delta_l = Q / inv_l * g_w * (0 - e_l)
+            rating[:, w] += delta_w
+            rating[:, l] += delta_l
+            gl_sum += delta_w + delta_l
+            rd[:, w] = np.sqrt(1 / inv_w)
+            rd[:, l] = np.sqrt(1 / inv_l)
+
+        if m >= burn_in:
+            scored += 1
+    elapsed = time.perf_counter() - start
+
+    results = grid.copy()
+    loss = np.empty(len(grid))
+    loss[is_elo] = elo_loss
+    loss[~is_elo] = gl_loss
+    results["log_loss"] = loss / max(scored, 1)
+    results = results.sort_values("log_loss", kind="stable").reset_index(drop=True)
+    return results, {"matches": n_matches, "scored": scored, "players": n_players,
+                     "configs": len(grid), "seconds": elapsed}
+
+
+def describe(config):
+    if config["model"] == "elo":
+        return f"Elo K={config['k']:g}, newcomer offset {config['offset']:+g}"
+    return f"Glicko RD={config['rd']:g}, RD growth {config['rd_growth']:g}/game, newcomer offset {config['offset']:+g}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune Elo settings by replaying the match history.")
+    parser.add_argument("matches", nargs="?", default="match_history.json", help="match history JSON file")
+    parser.add_argument("--k", nargs="+", type=float, default=DEFAULT_K_VALUES, help="K values to try")
+    parser.add_argument("--offset", nargs="+", type=float, default=DEFAULT_OFFSETS,
+                        help="newcomer rating relative to the pool average")
+    parser.add_argument("--glicko", action="store_true", help="also try Glicko-style rating deviation")
+    parser.add_argument("--rd", nargs="+", type=float, default=DEFAULT_RDS, help="Glicko starting deviations")
+    parser.add_argument("--rd-growth", nargs="+", type=float, default=DEFAULT_RD_GROWTH,
+                        help="Glicko deviation growth per game")
+    parser.add_argument("--burn-in", type=int, default=0, help="matches to replay before scoring starts")
+    parser.add_argument("--top", type=int, default=10, help="rows of the ranking to print")
+    args = parser.parse_args()
+
+    with open(args.matches, "r") as f:
+        matches = json.load(f)
+    if not matches:
+        parser.error(f"{args.matches} has no matches to replay")
+
+    grid = build_grid(args.k, args.offset, args.glicko, args.rd, args.rd_growth)
+    results, stats = backtest(matches, grid, burn_in=args.burn_in)
+
+    print(results.head(args.top).to_string(index=False))
+    best = results.iloc[0]
+    current = results[(results["model"] == "elo") & (results["k"] == K) & (results["offset"] == 0)]
+    print()
+    print(f"Best: {describe(best)} (log-loss {best['log_loss']:.4f})")
+    if not current.empty:
+        print(f"Current: {describe(current.iloc[0])} (log-loss {current.iloc[0]['log_loss']:.4f})")
+    print(f"{stats['configs']} configs x {stats['matches']} matches ({stats['players']} players) "
+          f"replayed in {stats['seconds']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
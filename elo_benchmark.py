@@ -0,0 +1,195 @@
+# Scale benchmark for the Elo engine
+#builds synthetic leagues and times every stage the dashboard runs on a rerun,
+#writing the results to JSON so later runs can be compared against them
+#
+#usage: python elo_benchmark.py --sizes 50x1000 200x100000 1000x1000000 --output bench_elo.json
+#       python elo_benchmark.py --output bench_new.json --compare bench_elo.json
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+from elo_core import (
+    START_RATING, build_elo_chart, build_leaderboard, expected_score, load_league, replay_history,
+    save_league, sort_history, update_ratings,
+)
+from script_tools import measure
+
+#history replay is the slow stage, so the default sizes stop well short of a million matches
+DEFAULT_SIZES = ["50x1000", "200x10000", "500x50000"]
+STAGES = ["update_elo", "replay", "save", "load", "leaderboard", "chart_data"]
+#what a stage reads that an earlier stage has to produce first
+NEEDS = {"save": ["update_elo"], "load": ["update_elo", "save"], "leaderboard": ["update_elo"]}
+LEAGUE = "benchmark"
+
+
+def parse_size(size):
+    players, sep, matches = size.lower().partition("x")
+    if not sep:
+        raise ValueError("expected PLAYERSxMATCHES, like 200x10000")
+    players, matches = int(players), int(matches)
+    #pairings draw an opponent other than the player, which needs a second player
+    if players < 2:
+        raise ValueError("a league needs at least 2 players")
+    if matches < 1:
+        raise ValueError("a league needs at least 1 match")
+    return players, matches
+
+
+#argparse type for --sizes, so a bad size fails before any league is built
+def league_size(size):
+    try:
+        parse_size(size)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"invalid size {size!r}: {e}")
+    return size
+
+
+#random pairings over one match per minute, winners drawn from hidden strengths
+#so the ratings spread out like a real league's
+def synthetic_league(n_players, n_matches, seed=0):
+    rng = np.random.default_rng(seed)
+    names = np.array([f"player_{i:06d}" for i in range(n_players)])
+    strength = rng.normal(START_RATING, 200, n_players)
+
+    p1 = rng.integers(0, n_players, n_matches)
+    p2 = (p1 + rng.integers(1, n_players, n_matches)) % n_players
+    p1_wins = rng.random(n_matches) < expected_score(strength[p1], strength[p2])
+    winner = np.where(p1_wins, p1, p2)
+    start = date(2020, 1, 1)
+    days = np.arange(n_matches) // 1440
+    dates = [str(start + timedelta(days=int(d))) for d in days]
+
+    return [
+        {"date": d, "player1": a, "player2": b, "winner": w}
+        for d, a, b, w in zip(dates, names[p1].tolist(), names[p2].tolist(), names[winner].tolist())
+    ]
+
+
+def stage_functions(matches, workdir):
+    state = {}
+
+    def run_update():
+        ratings = {}
+        for match in matches:
+            loser = match["player2"] if match["winner"] == match["player1"] else match["player1"]
+            update_ratings(ratings, match["winner"], loser)
+        state["ratings"] = ratings
+
+    def run_replay():
+        state["records"] = len(replay_history(pd.DataFrame(matches)))
+
+    def run_save():
+        save_league(LEAGUE, state["ratings"], matches, root=workdir)
+
+    def run_load():
+        load_league(LEAGUE, root=workdir)
+
+    def run_leaderboard():
+        build_leaderboard(state["ratings"])
+        sort_history(pd.DataFrame(matches))
+
+    #st.altair_chart serializes the whole frame with altair's row limit lifted, so do the same
+    def run_chart_data():
+        with alt.data_transformers.disable_max_rows():
+            build_elo_chart(pd.DataFrame(matches)).to_dict()
+
+    return {
+        "update_elo": run_update,
+        "replay": run_replay,
+        "save": run_save,
+        "load": run_load,
+        "leaderboard": run_leaderboard,
+        "chart_data": run_chart_data,
+    }
+
+
+def run_benchmarks(sizes, stages, repeat, memory=True):
+    results = []
+    for size in sizes:
+        n_players, n_matches = parse_size(size)
+        matches = synthetic_league(n_players, n_matches)
+        with tempfile.TemporaryDirectory() as workdir:
+            functions = stage_functions(matches, workdir)
+            needed = set(stages).union(*(NEEDS.get(stage, []) for stage in stages))
+            for stage in [stage for stage in STAGES if stage in needed]:
+                if stage not in stages:
+                    #only there for a later stage, so it runs once and isn't reported
+                    functions[stage]()
+                    continue
+                seconds, peak, _ = measure(functions[stage], repeat, memory)
+                result = {
+                    "stage": stage,
+                    "players": n_players,
+                    "matches": n_matches,
+                    "seconds": round(seconds, 6),
+                    "per_match_us": round(seconds / n_matches * 1e6, 3),
+                    "peak_mb": round(peak / 2 ** 20, 3) if peak is not None else None,
+                }
+                results.append(result)
+                memory_note = f"{result['peak_mb']:10.1f}MB peak" if peak is not None else ""
+                print(f"{size:>14} {stage:<12} {seconds:10.4f}s {result['per_match_us']:10.2f}us/match "
+                      f"{memory_note}", flush=True)
+    return results
+
+
+#stages that got slower than the baseline by more than `tolerance` (0.25 = 25%)
+def find_regressions(results, baseline, tolerance):
+    previous = {(r["stage"], r["players"], r["matches"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get((result["stage"], result["players"], result["matches"]))
+        if old and result["seconds"] > old["seconds"] * (1 + tolerance):
+            regressions.append({**result, "baseline_seconds": old["seconds"]})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Elo engine on synthetic leagues.")
+    parser.add_argument("--sizes", nargs="+", type=league_size, default=DEFAULT_SIZES, help="leagues as PLAYERSxMATCHES")
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES, help="stages to time")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage, the best one is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the extra traced run for peak memory")
+    parser.add_argument("--output", default="bench_elo.json", help="where to write the results")
+    parser.add_argument("--compare", help="earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing")
+    args = parser.parse_args()
+
+    #read the baseline first, it may be the file this run is about to overwrite
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+
+    results = run_benchmarks(args.sizes, args.stages, args.repeat, memory=not args.no_memory)
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    if baseline:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r['stage']} {r['players']}x{r['matches']}: "
+                  f"{r['baseline_seconds']:.4f}s -> {r['seconds']:.4f}s")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# Elo rating math and league storage shared by the dashboard and the offline tools
+
+import json
+import os
+import re
+
+import altair as alt
+import pandas as pd
+
+K = 32
+START_RATING = 1500
+
+#the original ping pong league keeps its files where they always were,
+#every other league gets its own folder under LEAGUE_DIR
+ELO_FILE = "elo_ratings.json"
+MATCH_FILE = "match_history.json"
+LEAGUE_DIR = "leagues"
+DEFAULT_LEAGUE = "ping_pong"
+
+
+#works on plain floats and on numpy arrays alike
+def expected_score(rating_a, rating_b):
+    return 1 / (1 + 10 ** ((rating_b - rating_a) / 400))
+
+
+def update_ratings(ratings, winner, loser, k=K):
+    rating_winner = ratings.get(winner, START_RATING)
+    rating_loser = ratings.get(loser, START_RATING)
+
+    expected_win = expected_score(rating_winner, rating_loser)
+    expected_lose = 1 - expected_win
+
+    ratings[winner] = rating_winner + k * (1 - expected_win)
+    ratings[loser] = rating_loser + k * (0 - expected_lose)
+
+
+# Tables and chart data
+def build_leaderboard(ratings):
+    ratings_df = pd.DataFrame(list(ratings.items()), columns=["Player", "ELO"])
+    ratings_df["ELO"] = ratings_df["ELO"].astype(float).round(1)
+    ratings_df = ratings_df.sort_values("ELO", ascending=False, kind="stable").reset_index(drop=True)
+    ratings_df.insert(0, "Rank", range(1, len(ratings_df) + 1))
+    return ratings_df
+
+
+def sort_history(match_df):
+    if match_df.empty:
+        return match_df
+    return match_df.sort_values("date", ascending=False, kind="stable").reset_index(drop=True)
+
+
+#replays every match in date order, recording both players' rating after each one
+def replay_history(match_df, k=K):
+    temp_ratings = {}
+    history_records = []
+
+    ordered = match_df.sort_values("date")
+    #parsed in one pass instead of once per row; "mixed" still reads each date on its own
+    dates = pd.to_datetime(ordered["date"], format="mixed")
+    for p1, p2, winner, date in zip(ordered["player1"], ordered["player2"], ordered["winner"], dates):
+        loser = p2 if winner == p1 else p1
+
+        for player in [p1, p2]:
+            temp_ratings.setdefault(player, START_RATING)
+
+        expected_win = expected_score(temp_ratings[winner], temp_ratings[loser])
+        expected_lose = 1 - expected_win
+
+        temp_ratings[winner] += k * (1 - expected_win)
+        temp_ratings[loser] += k * (0 - expected_lose)
+
+        for player in [p1, p2]:
+            history_records.append({
+                "date": date,
+                "player": player,
+                "elo": temp_ratings[player]
+            })
+
+    return history_records
+
+
+def build_elo_chart(match_df):
+    elo_df = pd.DataFrame(replay_history(match_df))
+    return alt.Chart(elo_df).mark_line().encode(
+        x='date:T',
+        y='elo:Q',
+        color='player:N'
+    ).properties(width=700, height=400)
+
+
+# League storage
+def league_slug(name):
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+def league_name(league):
+    return league.replace("_", " ").title()
+
+
+def league_paths(league, root="."):
+    if league == DEFAULT_LEAGUE:
+        folder = root
+    else:
+        folder = os.path.join(root, LEAGUE_DIR, league)
+    return os.path.join(folder, ELO_FILE), os.path.join(folder, MATCH_FILE)
+
+
+def list_leagues(root="."):
+    leagues = [DEFAULT_LEAGUE]
+    folder = os.path.join(root, LEAGUE_DIR)
+    if os.path.isdir(folder):
+        leagues += sorted(
+            name for name in os.listdir(folder)
+            if name != DEFAULT_LEAGUE and os.path.isdir(os.path.join(folder, name))
+        )
+    return leagues
+
+
+def create_league(name, root="."):
+    league = league_slug(name)
+    if not league:
+        raise ValueError("League name needs at least one letter or digit")
+    if league != DEFAULT_LEAGUE:
+        os.makedirs(os.path.join(root, LEAGUE_DIR, league), exist_ok=True)
+    return league
+
+
+#changes whenever either shard file is rewritten, used as a cache key
+def league_mtimes(league, root="."):
+    return tuple(
+        os.path.getmtime(path) if os.path.exists(path) else None
+        for path in league_paths(league, root)
+    )
+
+
+def load_league(league, root="."):
+    elo_path, match_path = league_paths(league, root)
+    ratings, matches = {}, []
+    if os.path.exists(elo_path):
+        with open(elo_path, "r") as f:
+            ratings = json.load(f)
+    if os.path.exists(match_path):
+        with open(match_path, "r") as f:
+            matches = json.load(f)
+    return ratings, matches
+
+
+def save_league(league, ratings, matches, root="."):
+    elo_path, match_path = league_paths(league, root)
+    os.makedirs(os.path.dirname(elo_path) or ".", exist_ok=True)
+    with open(elo_path, "w") as f:
+        json.dump(ratings, f)
+    with open(match_path, "w") as f:
+        json.dump(matches, f)
+
+
+def clear_league(league, root="."):
+    for path in league_paths(league, root):
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,169 @@
+# Monte Carlo tournament simulation on top of the current Elo ratings
+#every simulated game is a coin flip weighted by expected_score, and whole
+#batches of tournaments are played at once as numpy arrays
+
+import numpy as np
+import pandas as pd
+
+from elo_core import expected_score
+
+Z_95 = 1.96
+#caps the size of one batch of simulated games (sims x players x players)
+CHUNK_CELLS = 20_000_000
+#past this many simulated games a round robin samples win totals instead of single games
+EXACT_GAME_BUDGET = 10_000_000
+
+
+def win_probability_matrix(ratings):
+    ratings = np.asarray(ratings, dtype=np.float64)
+    return expected_score(ratings[:, None], ratings[None, :])
+
+
+#standard seeding so the top seeds can only meet in the late rounds (1v8, 4v5, 2v7, 3v6)
+def bracket_order(size):
+    order = [0]
+    while len(order) < size:
+        slots = len(order) * 2
+        order = [seed for s in order for seed in (s, slots - 1 - s)]
+    return np.array(order)
+
+
+#ranks each row of win totals, a random fraction breaks ties between equal totals
+def places_from_wins(wins, rng):
+    score = wins + rng.random(wins.shape)
+    order = np.argsort(-score, axis=1)
+    places = np.empty(wins.shape, dtype=np.int32)
+    np.put_along_axis(places, order, np.arange(1, wins.shape[1] + 1, dtype=np.int32)[None, :], axis=1)
+    return places
+
+
+def round_robin_wins_exact(probs, n_sims, rng):
+    n = len(probs)
+    probs = probs.astype(np.float32)
+    upper = np.triu(np.ones((n, n), dtype=bool), k=1)
+    wins = np.empty((n_sims, n), dtype=np.int32)
+
+    chunk = max(1, CHUNK_CELLS // max(1, n * n))
+    for start in range(0, n_sims, chunk):
+        size = min(chunk, n_sims - start)
+        #only the upper triangle is used: game (i, j) is played once, i wins when the draw is below p
+        i_wins = rng.random((size, n, n), dtype=np.float32) < probs
+        wins[start:start + size] = (i_wins & upper).sum(axis=2) + (~i_wins & upper).sum(axis=1)
+    return wins
+
+
+#win totals drawn from a normal with the exact mean and covariance of the schedule:
+#game (i, j) adds p(1-p) to both variances and -p(1-p) to their covariance
+def round_robin_wins_approx(probs, n_sims, rng):
+    variance = probs * (1 - probs)
+    np.fill_diagonal(variance, 0)
+    mean = probs.sum(axis=1) - np.diag(probs)
+    cov = np.diag(variance.sum(axis=1)) - variance
+    eigvals, eigvecs = np.linalg.eigh(cov)
+    factor = eigvecs * np.sqrt(np.clip(eigvals, 0, None))
+    wins = mean + rng.standard_normal((n_sims, len(probs))) @ factor.T
+    return np.clip(np.rint(wins), 0, len(probs) - 1)
+
+
+#returns the finishing place (1 = winner) of every player in every simulation
+def simulate_round_robin(ratings, n_sims, rng):
+    n = len(ratings)
+    probs = win_probability_matrix(ratings)
+    if n_sims * n * (n - 1) // 2 <= EXACT_GAME_BUDGET:
+        wins = round_robin_wins_exact(probs, n_sims, rng)
+    else:
+        wins = round_robin_wins_approx(probs, n_sims, rng)
+    return places_from_wins(wins, rng)
+
+
+def simulate_bracket(ratings, n_sims, rng):
+    ratings = np.asarray(ratings, dtype=np.float64)
+    n = len(ratings)
+    rounds = int(np.ceil(np.log2(n))) if n > 1 else 0
+    size = 2 ** rounds
+
+    #seeds past the field are byes; a bye has rating -inf so it always loses
+    seeds = np.argsort(-ratings, kind="stable")
+    slots = np.full(size, n)
+    slots[:n] = seeds
+    field = slots[bracket_order(size)]
+    padded = np.append(ratings, -np.inf)
+
+    alive = np.tile(field, (n_sims, 1))
+    #round in which each player was knocked out; the champion keeps `rounds`
+    eliminated = np.full((n_sims, n + 1), rounds, dtype=np.int32)
+    rows = np.arange(n_sims)[:, None]
+    with np.errstate(over="ignore", invalid="ignore"):
+        for rnd in range(rounds):
+            a, b = alive[:, 0::2], alive[:, 1::2]
+            p = expected_score(padded[a], padded[b])
+            a_wins = rng.random(p.shape, dtype=np.float32) < p
+            losers = np.where(a_wins, b, a)
+            eliminated[rows, losers] = rnd
+            alive = np.where(a_wins, a, b)
+    eliminated = eliminated[:, :n]
+
+    #everyone knocked out in the same round shares a place
+    width = rounds + 2
+    cells = (np.arange(n_sims)[:, None] * width + eliminated).ravel()
+    reached = np.bincount(cells, minlength=n_sims * width).reshape(n_sims, width)
+    went_further = np.cumsum(reached[:, ::-1], axis=1)[:, ::-1]
+    return 1 + np.take_along_axis(went_further, eliminated + 1, axis=1)
+
+
+#turns per-simulation places into win probabilities and expected ranks with 95% intervals
+def summarize(players, ratings, places):
+    n_sims = places.shape[0]
+    wins = (places == 1).sum(axis=0)
+    p = wins / n_sims
+    #wilson interval stays inside [0, 1] even for long shots
+    denom = 1 + Z_95 ** 2 / n_sims
+    centre = (p + Z_95 ** 2 / (2 * n_sims)) / denom
+    spread = Z_95 * np.sqrt(p * (1 - p) / n_sims + Z_95 ** 2 / (4 * n_sims ** 2)) / denom
+
+    mean_rank = places.mean(axis=0)
+    rank_se = places.std(axis=0) / np.sqrt(n_sims)
+    low_rank, high_rank = np.percentile(places, [5, 95], axis=0)
+
+    result = pd.DataFrame({
+        "Player": players,
+        "ELO": np.round(ratings, 1),
+        "Win %": 100 * p,
+        "Win % low": 100 * np.maximum(centre - spread, 0),
+        "Win % high": 100 * np.minimum(centre + spread, 1),
+        "Expected Rank": mean_rank,
+        "Expected Rank ±": Z_95 * rank_se,
+        "Rank 5th pct": low_rank,
+        "Rank 95th pct": high_rank,
+    })
+    return result.sort_values(["Win %", "Expected Rank"], ascending=[False, True]).reset_index(drop=True)
+
+
+FORMATS = ["round robin", "bracket"]
+
+
+def simulate_tournament(ratings, fmt="round robin", n_sims=10_000, seed=None):
+    players = list(ratings)
+    values = np.array([ratings[player] for player in players], dtype=np.float64)
+    if len(players) < 2:
+        raise ValueError("At least two players are needed to simulate a tournament")
+
+    rng = np.random.default_rng(seed)
+    if fmt == "round robin":
+        places = simulate_round_robin(values, n_sims, rng)
+    elif fmt == "bracket":
+        places = simulate_bracket(values, n_sims, rng)
+    else:
+        raise ValueError(f"Unknown tournament format: {fmt}")
+    return summarize(players, values, places)
+
+
+#best-of-n series between two players; returns the win probability of player a and its 95% interval
+def simulate_matchup(rating_a, rating_b, best_of=1, n_sims=100_000, seed=None):
+    rng = np.random.default_rng(seed)
+    p = expected_score(rating_a, rating_b)
+    games = rng.random((n_sims, best_of)) < p
+    a_won = games.sum(axis=1) > best_of // 2
+    win = a_won.mean()
+    spread = Z_95 * np.sqrt(win * (1 - win) / n_sims)
+    return win, max(win - spread, 0.0), min(win + spread, 1.0)
@@ -1,23 +1,61 @@
 import streamlit as st
 import pandas as pd
 import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from feedback_cluster import cluster_feedback, cluster_prompt
+from feedback_ingest import SHEET_COLUMN, combine_sheets, file_hash, load_sheets, load_table, read_preview, read_sample, sheet_names
+from feedback_labeling import row_texts
+from feedback_store import lookup, row_hashes, save, set_hash
+from feedback_text import SAMPLE_ROWS, detect_feedback_columns, serialize_feedback, token_savings
+
+#the summary is reused when a re-upload contains exactly the same rows
+SUMMARY_SCOPE = "excel:summary:v3"
+ROWS_SCOPE = "excel:rows"
+#past this many distinct comments the prompt gets cluster representatives instead of every comment
+MAX_DIRECT_COMMENTS = 60
 
 api_key = st.secrets["IBM_API_KEY"]
 project_id = st.secrets["PROJECT_ID"]
 
 
-def extract_text(uploaded_file):
-    
-    try:
-        if uploaded_file.name.endswith(".csv"):
-            df = pd.read_csv(uploaded_file)
-        else:
-            df = pd.read_excel(uploaded_file)
-    except pd.errors.EmptyDataError:
-        return None 
+#parsed once per file content and shared by every rerun and session;
+#picked workbook sheets come back as one frame with a Sheet column
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_upload(key, name, _data, sheets=None):
+    if not sheets:
+        return load_table(_data, name, key=key)
+    return combine_sheets(load_sheets(_data, name, sheets, key=key))
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_preview(key, name, _data, nrows=5, sheet=None):
+    return read_preview(_data, name, nrows=nrows, sheet=sheet)
+
+#one entry per file and sheet selection, however many sheets are picked
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_sample(key, name, _data, sheets=None):
+    return read_sample(_data, name, sheets, nrows=SAMPLE_ROWS)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def list_sheets(key, name, _data):
+    return sheet_names(_data, name)
+
 
-    text = "\n".join(df.astype(str).fillna("").values.flatten())
-    return text
+#every distinct comment for a small sheet; past MAX_DIRECT_COMMENTS similar comments
+#are grouped locally, so the prompt stays the same size however many rows there are
+def feedback_text(df, columns):
+    text, stats = serialize_feedback(df, columns)
+    clusters = None
+    if stats["lines"] > MAX_DIRECT_COMMENTS:
+        clusters = cluster_feedback(row_texts(df[columns]))
+        text = cluster_prompt(clusters)
+    return text, stats, clusters
+
+def cluster_table(clusters):
+    return pd.DataFrame([
+        {"Comments": c["size"], "Share": f"{c['share']:.0%}", "Examples": " / ".join(c["examples"])}
+        for c in clusters
+    ])
 
 
 def get_auth_token(api_key):
@@ -63,34 +101,109 @@ def main():
     uploaded_excel = st.file_uploader("Upload an Excel or .csv file...", type=["xlsx", "csv"])
 
     if uploaded_excel is not None:
-        if uploaded_excel.name.endswith(".csv"):
-            df = pd.read_csv(uploaded_excel)
-        else:
-            df = pd.read_excel(uploaded_excel)
+        data = uploaded_excel.getvalue()
+        key = file_hash(data)
+
+        #workbooks with several sheets (e.g. one per region) are analyzed together
+        sheets = list_sheets(key, uploaded_excel.name, data)
+        selected = None
+        if len(sheets) > 1:
+            selected = st.multiselect("Sheets", sheets, default=sheets, key=f"sheets_{key}")
+            if not selected:
+                st.warning("Pick at least one sheet.")
+                return
+            selected = tuple(selected)
 
         st.subheader("Preview")
-        st.write(df.head())
+        st.write(load_preview(key, uploaded_excel.name, data, sheet=selected[0] if selected else None))
+
+        #only the free-text columns go to the model, guessed from the first rows of each sheet
+        sample = load_sample(key, uploaded_excel.name, data, selected)
+        columns = st.multiselect(
+            "Feedback column(s)", list(sample.columns),
+            default=detect_feedback_columns(sample), key=f"columns_{key}"
+        )
+        if not columns:
+            st.warning("Pick at least one column that holds the feedback text.")
+            return
 
         analyze_button = st.button("Analyze Feedback")
 
         if analyze_button:
-            uploaded_excel.seek(0)
-            text_from_excel = extract_text(uploaded_excel)
-            system_prompt = {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": (
-                        "Given the following customer feedback data, please answer in plain English (do not write code):\n"
-                        "- Summarize the most common feedback points.\n"
-                        "- Only provide a short summary, not code or pseudocode.\n"
-                        "- State if the overall sentiment is positive or negative, and briefly reference the evidence supporting that sentiment.\n"
-                        "- At the bottom of everything, seperated, if the overall is positive feedback, then just say Positive, else just say Negative.\n\n"
-                        f"{text_from_excel}"
-                    )}
-                ]
-            }
-            with st.spinner("Analyzing feedback..."):
-                ai_response = query_model([system_prompt])
+            with st.spinner("Reading sheets..." if selected else "Reading file..."):
+                df = load_upload(key, uploaded_excel.name, data, selected)
+            #the sheet is part of a row's identity, so moving rows between sheets is a change
+            texts = row_texts(df[[SHEET_COLUMN, *columns]] if selected else df[columns])
+            hashes = row_hashes(texts)
+            seen = lookup(hashes, ROWS_SCOPE)
+            seen_ratio = hashes.isin(seen.keys()).mean() if len(hashes) else 0.0
+            upload_key = set_hash(hashes)
+            ai_response = lookup([upload_key], SUMMARY_SCOPE).get(upload_key)
+
+            if ai_response is None and selected:
+                #one section per sheet, the sheets prepared side by side
+                frames = dict(tuple(df.groupby(SHEET_COLUMN, sort=False)))
+                frames = {sheet: frames[sheet] for sheet in selected if sheet in frames}
+                with ThreadPoolExecutor(max_workers=4) as pool:
+                    sections = dict(zip(frames, pool.map(lambda frame: feedback_text(frame, columns), frames.values())))
+                text_from_excel = "\n\n".join(
+                    f"### Sheet: {sheet} ({stats['rows']:,} rows)\n{text}" for sheet, (text, stats, _) in sections.items()
+                )
+                text_stats = {name: sum(stats[name] for _, stats, _ in sections.values())
+                              for name in ("rows", "lines", "empty", "duplicates")}
+                intro = (
+                    "Given the following customer feedback, in one section per spreadsheet sheet (small sheets list each "
+                    "distinct comment on a numbered line with repeats shown as (xN), large ones are grouped by similarity "
+                    "with the number of comments in each group and a few representative comments)"
+                )
+                per_sheet = "- After the overall summary, give one or two sentences on each sheet, naming the sheet.\n"
+                st.dataframe(pd.DataFrame([
+                    {"Sheet": sheet, "Rows": stats["rows"], "Distinct comments": stats["lines"],
+                     "Sent as": f"{len(clusters)} groups" if clusters else "every comment"}
+                    for sheet, (_, stats, clusters) in sections.items()
+                ]), use_container_width=True, hide_index=True)
+                for sheet, (_, _, clusters) in sections.items():
+                    if clusters:
+                        with st.expander(f"{sheet}: {len(clusters)} feedback groups sent to the model"):
+                            st.dataframe(cluster_table(clusters), use_container_width=True, hide_index=True)
+            elif ai_response is None:
+                text_from_excel, text_stats, clusters = feedback_text(df, columns)
+                if clusters:
+                    intro = "Given the following customer feedback, grouped by similarity with the number of comments in each group and a few representative comments"
+                    with st.expander(f"{len(clusters)} feedback groups sent to the model"):
+                        st.dataframe(cluster_table(clusters), use_container_width=True, hide_index=True)
+                else:
+                    intro = "Given the following customer feedback comments (one per numbered line, repeats shown as (xN))"
+                per_sheet = ""
+
+            if ai_response is None:
+                savings = token_savings(df, text_from_excel)
+                st.caption(
+                    f"{text_stats['lines']:,} distinct comments from {text_stats['rows']:,} rows: "
+                    f"~{savings['after']:,} tokens sent instead of ~{savings['before']:,} ({savings['saved']:.0%} fewer). "
+                    f"{text_stats['empty']:,} empty and {text_stats['duplicates']:,} repeated rows folded."
+                )
+                system_prompt = {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": (
+                            f"{intro}, please answer in plain English (do not write code):\n"
+                            "- Summarize the most common feedback points.\n"
+                            "- Only provide a short summary, not code or pseudocode.\n"
+                            "- State if the overall sentiment is positive or negative, and briefly reference the evidence supporting that sentiment.\n"
+                            f"{per_sheet}"
+                            "- At the bottom of everything, seperated, if the overall is positive feedback, then just say Positive, else just say Negative.\n\n"
+                            f"{text_from_excel}"
+                        )}
+                    ]
+                }
+                with st.spinner("Analyzing feedback..."):
+                    ai_response = query_model([system_prompt])
+                save({upload_key: ai_response}, SUMMARY_SCOPE)
+                save({row_hash: "" for row_hash in hashes}, ROWS_SCOPE)
+                st.caption(f"{seen_ratio:.0%} of these rows were in an earlier upload")
+            else:
+                st.caption(f"Same rows as an earlier upload ({seen_ratio:.0%} reused), showing the stored analysis without a model call")
             st.subheader("Analysis Result")
             st.write(ai_response)
     else:
@@ -1,60 +1,42 @@
 import streamlit as st
-import pandas as pd
-import requests
+
+from feedback_ingest import SHEET_COLUMN, combine_sheets, file_hash, load_sheets, load_table, read_preview, read_sample, sheet_names
+from feedback_text import SAMPLE_ROWS, detect_feedback_columns
+from feedback_labeling import (
+    column_breakdowns, merge_labels, representative_examples, row_texts, sentiment_counts, summary_prompt,
+)
+from feedback_lexicon import THRESHOLD, label_with_lexicon
+from model_client import ModelClient
+
+#labeling batches: prompt size, parallel calls and the shared request rate
+BATCH_TOKENS = 3000
+MAX_WORKERS = 4
+REQUESTS_PER_MINUTE = 60
 
 api_key = st.secrets["IBM_API_KEY"]
 project_id = st.secrets["PROJECT_ID"]
 
-def extract_text(uploaded_file):
-    
-    try:
-        if uploaded_file.name.endswith(".csv"):
-            df = pd.read_csv(uploaded_file)
-        else:
-            df = pd.read_excel(uploaded_file)
-    except pd.errors.EmptyDataError:
-        return None 
-
-    text = "\n".join(df.astype(str).fillna("").values.flatten())
-    return text
-
-
-def get_auth_token(api_key):
-    auth_url = "https://iam.cloud.ibm.com/identity/token"
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Accept": "application/json"
-    }
-    data = {
-        "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-        "apikey": api_key
-    }
-    response = requests.post(auth_url, headers=headers, data=data, verify=False)
-    if response.status_code == 200:
-        return response.json().get("access_token")
-    else:
-        raise Exception("Failed to get authentication token")
-
-def query_model(messages):
-    url = "https://us-south.ml.cloud.ibm.com/ml/v1/text/chat?version=2023-05-29"
-    body = {
-        "messages": messages,
-        "project_id": project_id, 
-        "model_id": "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8",
-        "decoding_method": "greedy",
-        "repetition_penalty": 1,
-        "max_tokens": 2000
-    }
-    token = get_auth_token(api_key)
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {token}"
-    }
-    response = requests.post(url, headers=headers, json=body)
-    if response.status_code != 200:
-        raise Exception(f"Non-200 response: {response.text}")
-    return response.json()['choices'][0]['message']['content']
+#parsed once per file content and shared by every rerun and session;
+#picked workbook sheets come back as one frame with a Sheet column
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_upload(key, name, _data, sheets=None):
+    if not sheets:
+        return load_table(_data, name, key=key)
+    return combine_sheets(load_sheets(_data, name, sheets, key=key))
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_preview(key, name, _data, nrows=5, sheet=None):
+    return read_preview(_data, name, nrows=nrows, sheet=sheet)
+
+#one entry per file and sheet selection, however many sheets are picked
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_sample(key, name, _data, sheets=None):
+    return read_sample(_data, name, sheets, nrows=SAMPLE_ROWS)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def list_sheets(key, name, _data):
+    return sheet_names(_data, name)
+
 
 def main():
     st.title("Analyze Uploaded Excel Feedback")
@@ -62,45 +44,136 @@ def main():
     uploaded_excel = st.file_uploader("Upload an Excel or .csv file...", type=["xlsx", "csv"])
 
     if uploaded_excel is not None:
-        if uploaded_excel.name.endswith(".csv"):
-            df = pd.read_csv(uploaded_excel)
-        else:
-            df = pd.read_excel(uploaded_excel)
+        data = uploaded_excel.getvalue()
+        key = file_hash(data)
+
+        #workbooks with several sheets (e.g. one per region) are analyzed together
+        sheets = list_sheets(key, uploaded_excel.name, data)
+        selected = None
+        if len(sheets) > 1:
+            selected = st.multiselect("Sheets", sheets, default=sheets, key=f"sheets_{key}")
+            if not selected:
+                st.warning("Pick at least one sheet.")
+                return
+            selected = tuple(selected)
 
         st.subheader("Preview")
-        st.write(df.head())
+        st.write(load_preview(key, uploaded_excel.name, data, sheet=selected[0] if selected else None))
+
+        #only the free-text columns are labeled, guessed from the first rows of each sheet
+        sample = load_sample(key, uploaded_excel.name, data, selected)
+        columns = st.multiselect(
+            "Feedback column(s)", list(sample.columns),
+            default=detect_feedback_columns(sample), key=f"columns_{key}"
+        )
+        if not columns:
+            st.warning("Pick at least one column that holds the feedback text.")
+            return
+
+        #raising this sends more rows to the model; at 1.0 the lexicon labels nothing
+        threshold = st.slider(
+            "Local labeling confidence", min_value=0.3, max_value=1.0, value=THRESHOLD, step=0.05,
+            help="Rows the word list scores at least this confidently are labeled without the model."
+        )
 
         analyze_button = st.button("Analyze Feedback")
 
         if analyze_button:
-            #postion our pointer at the starting position 
-            uploaded_excel.seek(0)
-            text_from_excel = extract_text(uploaded_excel)
+            with st.spinner("Reading sheets..." if selected else "Reading file..."):
+                full_df = load_upload(key, uploaded_excel.name, data, selected)
+
+            #every row gets its own label: clear-cut rows locally, the rest in batches that
+            #run side by side; rows already labeled in an earlier upload come from the store
+            progress_bar = st.progress(0.0, text="Labeling rows...")
+            def show_progress(done, total):
+                progress_bar.progress(done / max(total, 1), text=f"Labeled {done:,} of {total:,} rows")
+
+            #one client for the whole analysis; it refreshes its IAM token before the
+            #hour is up, however long labeling takes
+            client = ModelClient(api_key, project_id)
+            texts = row_texts(full_df[columns])
+            labels, stats = label_with_lexicon(
+                texts, client, threshold=threshold,
+                token_budget=BATCH_TOKENS, max_workers=MAX_WORKERS,
+                requests_per_minute=REQUESTS_PER_MINUTE, progress=show_progress,
+            )
+            progress_bar.empty()
+
+            #counts and breakdowns come from the labels, the model only writes the prose
+            labeled = merge_labels(full_df, labels)
+            counts = sentiment_counts(labeled)
+            breakdowns = column_breakdowns(labeled)
+            examples = representative_examples(labeled, texts)
             system_prompt = {
                 "role": "user",
                 "content": [
                     {"type": "text", "text": (
-                        "For the following customer feedback data, label each row as either Positive or Negative sentiment. Just do the first 50 rows. Don't give me a code output, just solve it and give me that output."
-                        "Return your answer as a two-column table with the original feedback in one column and the sentiment label (Positive/Negative) in the other. "
+                        "Below are sentiment statistics and representative comments from a customer feedback survey. "
+                        "Don't give me a code output, just solve it and give me that output.\n"
                         "- Summarize all the feedback into a specific, focused summary that uses evidence from diverse points to understand it.\n"
                         "- Only provide a short summary, not code or pseudocode.\n"
-                        "Finally, provide the total count of Positive and Negative labels.\n\n"
-                        f"{text_from_excel}"
+                        "- Use the counts exactly as given, do not recount.\n\n"
+                        f"{summary_prompt(counts, breakdowns, examples)}"
                     )}
                 ]
             }
             with st.spinner("Analyzing feedback..."):
-                ai_response = query_model([system_prompt])
+                ai_response = client([system_prompt])
+
+            #kept so the results survive reruns, e.g. clicking the download button
+            st.session_state["labeled_feedback"] = {
+                "key": key,
+                "sheets": selected,
+                "df": labeled,
+                "stats": stats,
+                "counts": counts,
+                "breakdowns": breakdowns,
+                "ai_response": ai_response,
+            }
+
+        result = st.session_state.get("labeled_feedback")
+        if result and result["key"] == key and result["sheets"] == selected:
+            stats = result["stats"]
+            st.subheader("Labeled Feedback")
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Rows labeled", f"{stats['labeled']:,} / {stats['rows']:,}")
+            col2.metric("Labeled locally", f"{stats['local_share']:.0%}")
+            col3.metric("Reused from earlier uploads", f"{stats['reuse_ratio']:.0%}")
+            col4.metric("Model calls", f"{stats['calls']:,}")
+            st.caption(
+                f"{stats['local']:,} rows labeled locally, {stats['reused']:,} reused, "
+                f"{stats['sent']:,} new or changed rows sent to the model"
+            )
+            if stats["agreement"] is not None:
+                st.caption(
+                    f"Local labels agreed with the model on {stats['agreement']:.0%} of "
+                    f"{stats['holdout']:,} held-out rows"
+                )
+            st.dataframe(result["df"], use_container_width=True)
+            st.download_button(
+                label="Download Labeled Rows",
+                data=result["df"].to_csv(index=False).encode("utf-8"),
+                file_name="labeled_feedback.csv",
+                mime="text/csv"
+            )
+
+            st.subheader("Official Sentiment Counts")
+            st.dataframe(result["counts"], use_container_width=True, hide_index=True)
+            st.bar_chart(result["counts"].set_index("Label")["Count"])
+            if result["sheets"]:
+                by_sheet = result["df"].groupby(SHEET_COLUMN, sort=False)
+                for tab, sheet in zip(st.tabs(list(result["sheets"])), result["sheets"]):
+                    with tab:
+                        if sheet in by_sheet.groups:
+                            st.dataframe(sentiment_counts(by_sheet.get_group(sheet)), use_container_width=True, hide_index=True)
+                        else:
+                            st.caption("No rows in this sheet.")
+            for name, table in result["breakdowns"].items():
+                with st.expander(f"Sentiment by {name}"):
+                    st.dataframe(table, use_container_width=True)
+
             st.subheader("Analysis Result")
-            st.write(ai_response)
-
-            # Optional: Try to extract and display counts in the UI if the model outputs them as "Positive: X, Negative: Y"
-            import re
-            counts = re.findall(r'(Positive|Negative)\s*[:\-]?\s*(\d+)', str(ai_response), re.IGNORECASE)
-            if counts:
-                st.subheader("Official Sentiment Counts")
-                for label, count in counts:
-                    st.write(f"{label}: {count}")
+            st.write(result["ai_response"])
 
     else:
         st.info("Please upload an Excel or .csv file to begin.")
@@ -0,0 +1,101 @@
+# Labels every row of a feedback spreadsheet without the Streamlit app
+#same ingestion and labeling as excel_mod.py; every finished batch is saved to
+#the row store, so rerunning an interrupted job only sends the rows it hadn't done
+#
+#usage: python feedback_cli.py survey.xlsx --columns Comments --output labeled.parquet
+
+import argparse
+import os
+import sys
+import time
+
+from feedback_ingest import load_table, parquet_safe, read_preview
+from feedback_labeling import LABEL_SCOPE, merge_labels, row_texts, sentiment_counts
+from feedback_lexicon import THRESHOLD, label_with_lexicon
+from feedback_store import STORE_PATH
+from feedback_text import SAMPLE_ROWS, detect_feedback_columns
+from model_client import SECRETS_PATH, ModelClient, load_credentials
+from script_tools import progress_printer
+
+BATCH_TOKENS = 3000
+MAX_WORKERS = 4
+REQUESTS_PER_MINUTE = 60
+PROGRESS_LINE = "labeled {done:,} / {total:,} rows sent to the model ({rate:,.0f} rows/s)"
+
+
+def default_output(path):
+    return f"{os.path.splitext(path)[0]}_labeled.parquet"
+
+
+def write_output(df, path):
+    #written under a temporary name so an interrupted write never leaves half a file
+    tmp_path = f"{path}.tmp"
+    if path.lower().endswith(".csv"):
+        df.to_csv(tmp_path, index=False)
+    else:
+        parquet_safe(df).to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Label the sentiment of every row of a CSV or XLSX feedback file.")
+    parser.add_argument("path", help="CSV or XLSX file")
+    parser.add_argument("--columns", nargs="+", help="feedback column(s), guessed from the first rows if omitted")
+    parser.add_argument("--output", help="Parquet or CSV file to write (default: <input>_labeled.parquet)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="model calls in flight at once")
+    parser.add_argument("--rpm", type=float, default=REQUESTS_PER_MINUTE, help="model requests per minute")
+    parser.add_argument("--batch-tokens", type=int, default=BATCH_TOKENS, help="prompt budget per labeling call")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="lexicon confidence for labeling a row locally (1.0 sends every row to the model)")
+    parser.add_argument("--store", default=STORE_PATH, help="row store used for checkpoints and reuse")
+    parser.add_argument("--secrets", default=SECRETS_PATH, help="secrets.toml to read credentials from")
+    args = parser.parse_args()
+
+    with open(args.path, "rb") as f:
+        data = f.read()
+    name = os.path.basename(args.path)
+    columns = args.columns or detect_feedback_columns(read_preview(data, name, nrows=SAMPLE_ROWS))
+    if not columns:
+        parser.error("no feedback column found, pass --columns")
+
+    df = load_table(data, name)
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        parser.error(f"not in {name}: {', '.join(missing)} (columns: {', '.join(map(str, df.columns))})")
+    try:
+        client = ModelClient(*load_credentials(args.secrets))
+    except RuntimeError as e:
+        parser.error(str(e))
+    print(f"{len(df):,} rows, labeling {', '.join(columns)}", file=sys.stderr)
+
+    started = time.time()
+    try:
+        labels, stats = label_with_lexicon(
+            row_texts(df[columns]), client, threshold=args.threshold, scope=LABEL_SCOPE, store_path=args.store,
+            token_budget=args.batch_tokens, max_workers=args.workers, requests_per_minute=args.rpm,
+            progress=progress_printer(started, PROGRESS_LINE),
+        )
+    except KeyboardInterrupt:
+        print(f"\ninterrupted after {client.calls:,} model calls; finished batches are saved in {args.store}, "
+              "rerun the same command to resume", file=sys.stderr)
+        sys.exit(130)
+    elapsed = time.time() - started
+    print(file=sys.stderr)
+
+    labeled = merge_labels(df, labels)
+    output = args.output or default_output(args.path)
+    write_output(labeled, output)
+
+    print(sentiment_counts(labeled).to_string(index=False))
+    print()
+    print(f"wrote {len(labeled):,} rows to {output}")
+    print(f"{stats['local']:,} labeled locally, {stats['reused']:,} reused from the store, "
+          f"{stats['sent']:,} sent to the model")
+    if stats["agreement"] is not None:
+        print(f"lexicon agreed with the model on {stats['agreement']:.0%} of {stats['holdout']:,} held-out rows")
+    print(f"{client.calls:,} model calls ({stats['failed_calls']:,} failed) in {elapsed:.1f}s, "
+          f"{len(labeled) / max(elapsed, 1e-9):,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# Groups similar feedback comments so a summary only needs a few representatives
+#comments are folded into exact (normalized) duplicates, hashed into TF-IDF
+#vectors with numpy, and clustered with spherical mini-batch k-means; each
+#cluster is described by its size and the comments closest to its centre
+
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from feedback_store import normalize_text
+
+N_FEATURES = 2 ** 12
+N_CLUSTERS = 12
+EXAMPLES_PER_CLUSTER = 3
+BATCH_SIZE = 512
+N_BATCHES = 60
+#rows densified at a time when scoring every comment against the centres
+CHUNK_ROWS = 2048
+
+WORD = re.compile(r"[^\W_]+")
+
+
+def tokens(text):
+    words = WORD.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+#sparse rows as (indptr, indices, values), l2-normalized tf-idf over hashed unigrams and bigrams
+def hashed_tfidf(texts, n_features=N_FEATURES):
+    indptr, indices = [0], []
+    for text in texts:
+        buckets = [zlib.crc32(token.encode("utf-8")) % n_features for token in tokens(text)]
+        indices.extend(buckets)
+        indptr.append(len(indices))
+    indptr = np.array(indptr, dtype=np.int64)
+    indices = np.array(indices, dtype=np.int64)
+    rows = np.repeat(np.arange(len(texts)), np.diff(indptr))
+
+    #collapse repeated buckets within a row into term counts
+    cells, counts = np.unique(rows * n_features + indices, return_counts=True)
+    rows, indices = cells // n_features, cells % n_features
+    doc_freq = np.bincount(indices, minlength=n_features)
+    idf = np.log((1 + len(texts)) / (1 + doc_freq)) + 1
+    values = (1 + np.log(counts)) * idf[indices]
+    norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=len(texts)))
+    values = values / np.maximum(norms[rows], 1e-12)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(texts)))])
+    return indptr, indices, values.astype(np.float32)
+
+
+def densify(matrix, rows, n_features=N_FEATURES):
+    indptr, indices, values = matrix
+    rows = np.asarray(rows)
+    starts, ends = indptr[rows], indptr[rows + 1]
+    lengths = ends - starts
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    out_rows = np.repeat(np.arange(len(rows)), lengths)
+    flat = np.bincount(out_rows * n_features + indices[positions], weights=values[positions],
+                       minlength=len(rows) * n_features)
+    return flat.reshape(len(rows), n_features).astype(np.float32)
+
+
+def normalize_rows(matrix):
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+#k-means++ seeding on a weighted sample, then mini-batch updates with per-centre learning rates
+def minibatch_kmeans(matrix, weights, k, rng):
+    n = len(weights)
+    probs = weights / weights.sum()
+    sample = densify(matrix, rng.choice(n, size=min(n, 20 * k + BATCH_SIZE), replace=False, p=probs))
+    centres = [sample[rng.integers(len(sample))]]
+    closest = 1 - sample @ centres[0]
+    for _ in range(1, k):
+        pick = closest.clip(0) ** 2
+        if pick.sum() <= 0:
+            break
+        centres.append(sample[rng.choice(len(sample), p=pick / pick.sum())])
+        closest = np.minimum(closest, 1 - sample @ centres[-1])
+    centres = np.array(centres)
+
+    seen = np.zeros(len(centres))
+    for _ in range(N_BATCHES):
+        batch_ids = rng.choice(n, size=min(n, BATCH_SIZE), p=probs)
+        batch = densify(matrix, batch_ids)
+        nearest = np.argmax(batch @ centres.T, axis=1)
+        for c in np.unique(nearest):
+            members = batch[nearest == c]
+            seen[c] += len(members)
+            rate = len(members) / seen[c]
+            centres[c] = (1 - rate) * centres[c] + rate * members.mean(axis=0)
+        centres = normalize_rows(centres)
+    return centres
+
+
+def assign(matrix, n_rows, centres):
+    labels = np.empty(n_rows, dtype=np.int64)
+    similarity = np.empty(n_rows, dtype=np.float32)
+    for start in range(0, n_rows, CHUNK_ROWS):
+        rows = np.arange(start, min(start + CHUNK_ROWS, n_rows))
+        scores = densify(matrix, rows) @ centres.T
+        labels[rows] = scores.argmax(axis=1)
+        similarity[rows] = scores.max(axis=1)
+    return labels, similarity
+
+
+#closest comments to the centre, skipping ones that mostly repeat an example already picked
+def pick_examples(group, examples, max_overlap=0.6):
+    picked, picked_words = [], []
+    for text in group.sort_values(["similarity", "count"], ascending=False)["text"]:
+        words = set(WORD.findall(text.lower()))
+        if any(len(words & other) / max(len(words | other), 1) >= max_overlap for other in picked_words):
+            continue
+        picked.append(text)
+        picked_words.append(words)
+        if len(picked) == examples:
+            break
+    return picked
+
+
+#returns one dict per cluster, largest first: size, share of all comments and example comments
+def cluster_feedback(texts, n_clusters=N_CLUSTERS, examples=EXAMPLES_PER_CLUSTER, seed=0):
+    texts = texts.fillna("").astype(str)
+    texts = texts[texts.str.strip() != ""]
+    if texts.empty:
+        return []
+    keys = texts.map(lambda text: " ".join(WORD.findall(normalize_text(text))))
+    distinct = pd.DataFrame({"text": texts, "key": keys}).groupby("key", sort=False).agg(
+        text=("text", "first"), count=("text", "size")
+    )
+    distinct = distinct[distinct.index != ""]
+    if distinct.empty:
+        return []
+    weights = distinct["count"].to_numpy(dtype=np.float64)
+    matrix = hashed_tfidf(distinct["text"].tolist())
+
+    k = min(n_clusters, len(distinct))
+    centres = minibatch_kmeans(matrix, weights, k, np.random.default_rng(seed))
+    labels, similarity = assign(matrix, len(distinct), centres)
+
+    distinct = distinct.assign(cluster=labels, similarity=similarity)
+    total = weights.sum()
+    clusters = []
+    for _, group in distinct.groupby("cluster"):
+        size = int(group["count"].sum())
+        clusters.append({
+            "size": size,
+            "share": size / total,
+            "examples": pick_examples(group, examples),
+        })
+    return sorted(clusters, key=lambda cluster: cluster["size"], reverse=True)
+
+
+def cluster_prompt(clusters, max_chars=300):
+    lines = []
+    for i, cluster in enumerate(clusters, 1):
+        lines.append(f"Group {i}: {cluster['size']} comments ({cluster['share']:.0%})")
+        lines += [f"- {text[:max_chars]}" for text in cluster["examples"]]
+    return "\n".join(lines)
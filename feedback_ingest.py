@@ -0,0 +1,228 @@
+# Spreadsheet ingestion for the feedback apps
+#an upload is parsed once (pyarrow for csv, streaming read-only openpyxl for xlsx)
+#and the frame is kept as parquet under the file's content hash (plus the sheet
+#name for workbooks), so later reruns, sessions and re-uploads of the same file
+#skip parsing entirely. Files not read for CACHE_TTL are dropped, as are the least
+#recently read ones once the cache passes CACHE_MAX_BYTES. Several sheets are
+#parsed side by side, on threads by default since the apps call this inside the
+#Streamlit server, where forking worker processes isn't safe
+
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from itertools import repeat
+
+import pandas as pd
+from openpyxl import load_workbook
+
+CACHE_DIR = ".feedback_cache"
+CACHE_TTL = 30 * 24 * 3600
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+PREVIEW_ROWS = 5
+MAX_SHEET_WORKERS = 4
+#added to a combined multi-sheet frame, naming the sheet each row came from
+SHEET_COLUMN = "Sheet"
+
+
+def file_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def is_csv(name):
+    return name.lower().endswith(".csv")
+
+
+#header row plus up to `nrows` rows, without touching the rest of the file
+def read_preview(data, name, nrows=PREVIEW_ROWS, sheet=None):
+    if not data.strip():
+        return pd.DataFrame()
+    if is_csv(name):
+        return pd.read_csv(BytesIO(data), nrows=nrows)
+    return read_xlsx(data, sheet=sheet, max_rows=nrows)
+
+
+#the first rows of every picked sheet as one frame, for guessing the text columns
+def read_sample(data, name, sheets=None, nrows=PREVIEW_ROWS):
+    return pd.concat([read_preview(data, name, nrows, sheet) for sheet in sheets or [None]], ignore_index=True)
+
+
+#csv files have no sheets
+def sheet_names(data, name):
+    if is_csv(name) or not data.strip():
+        return []
+    workbook = load_workbook(BytesIO(data), read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def header_names(header):
+    names, used = [], set()
+    for i, value in enumerate(header):
+        name = str(value) if value is not None else f"Unnamed: {i}"
+        base, n = name, 1
+        while name in used:
+            name = f"{base}.{n}"
+            n += 1
+        used.add(name)
+        names.append(name)
+    return names
+
+
+#rows are streamed straight into per-column lists, the workbook is never fully loaded
+def read_xlsx(data, sheet=None, max_rows=None):
+    workbook = load_workbook(BytesIO(data), read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.worksheets[0]
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+        names = header_names(header)
+        columns = [[] for _ in names]
+        count = 0
+        for row in rows:
+            if max_rows is not None and count >= max_rows:
+                break
+            if all(value is None for value in row):
+                continue
+            for i, column in enumerate(columns):
+                column.append(row[i] if i < len(row) else None)
+            count += 1
+    finally:
+        workbook.close()
+    return pd.DataFrame(dict(zip(names, columns)))
+
+
+def read_table(data, name, sheet=None):
+    if not data.strip():
+        return pd.DataFrame()
+    if is_csv(name):
+        try:
+            return pd.read_csv(BytesIO(data), engine="pyarrow")
+        except Exception:
+            #ragged rows and odd quoting that pyarrow rejects, the C parser copes with
+            return pd.read_csv(BytesIO(data))
+    return read_xlsx(data, sheet=sheet)
+
+
+#parquet needs one type per column; mixed text/number columns are stored as text
+def parquet_safe(df):
+    df = df.copy()
+    df.columns = [str(column) for column in df.columns]
+    for column in df.columns:
+        values = df[column]
+        if values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) not in ("string", "empty"):
+            df[column] = values.where(values.isna(), values.astype(str))
+    return df
+
+
+def cache_path(key, cache_dir=CACHE_DIR, sheet=None):
+    if sheet is None:
+        return os.path.join(cache_dir, f"{key}.parquet")
+    #sheet names can hold characters a file name can't
+    return os.path.join(cache_dir, f"{key}-{file_hash(sheet.encode('utf-8'))[:12]}.parquet")
+
+
+def write_parquet(df, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    #written under a temporary name so a half-written file is never read back
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    parquet_safe(df).to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+#a file's mtime is its last read, so the cache can drop what nobody has opened lately
+def touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+#removes cached frames not read within `ttl`, then the least recently read ones until
+#the rest fit in `max_bytes`; the files in `keep` were just written or read and stay
+def prune_cache(cache_dir=CACHE_DIR, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES, keep=()):
+    files = []
+    try:
+        with os.scandir(cache_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.name.endswith(".parquet"):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+                except OSError:
+                    pass
+    except OSError:
+        return
+    now, total = time.time(), 0
+    for mtime, size, path in sorted(files, reverse=True):
+        total += size
+        if path not in keep and (now - mtime > ttl or total > max_bytes):
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+#run in a worker; only the parquet file comes back, not the frame
+def cache_sheet(data, name, sheet, path):
+    df = read_table(data, name, sheet).reset_index(drop=True)
+    if len(df.columns):
+        write_parquet(df, path)
+
+
+def load_table(data, name, key=None, cache_dir=CACHE_DIR, sheet=None):
+    key = key or file_hash(data)
+    path = cache_path(key, cache_dir, sheet)
+    if os.path.exists(path):
+        touch(path)
+        return pd.read_parquet(path)
+
+    df = read_table(data, name, sheet).reset_index(drop=True)
+    if len(df.columns):
+        write_parquet(df, path)
+        prune_cache(cache_dir, keep={path})
+        df = pd.read_parquet(path)
+    return df
+
+
+#every sheet is cached on its own, so picking another sheet later only parses that one.
+#openpyxl parsing is pure python, so a command-line caller can pass
+#executor=ProcessPoolExecutor to parse uncached sheets on several cores
+def load_sheets(data, name, sheets, key=None, cache_dir=CACHE_DIR, max_workers=MAX_SHEET_WORKERS,
+                executor=ThreadPoolExecutor):
+    key = key or file_hash(data)
+    todo = [sheet for sheet in sheets if not os.path.exists(cache_path(key, cache_dir, sheet))]
+    workers = min(max_workers, len(todo), os.cpu_count() or 1)
+    if workers > 1:
+        with executor(max_workers=workers) as pool:
+            list(pool.map(cache_sheet, repeat(data), repeat(name), todo,
+                          [cache_path(key, cache_dir, sheet) for sheet in todo]))
+        prune_cache(cache_dir, keep={cache_path(key, cache_dir, sheet) for sheet in sheets})
+    return {sheet: load_table(data, name, key, cache_dir, sheet) for sheet in sheets}
+
+
+#one frame with a leading Sheet column; sheets with different headers line up by column name
+def combine_sheets(frames):
+    frames = [df.assign(**{SHEET_COLUMN: sheet}) for sheet, df in frames.items() if len(df.columns)]
+    if not frames:
+        return pd.DataFrame()
+    combined = pd.concat(frames, ignore_index=True)
+    return combined[[SHEET_COLUMN] + [column for column in combined.columns if column != SHEET_COLUMN]]
+
+
+#every non-empty cell as text, row by row, without building the whole flattened copy
+def iter_cells(df, columns=None):
+    frame = df[columns] if columns is not None else df
+    for row in frame.itertuples(index=False, name=None):
+        for value in row:
+            if value is None or (not isinstance(value, str) and pd.isna(value)):
+                continue
+            text = str(value)
+            if text:
+                yield text
@@ -0,0 +1,225 @@
+# Batch sentiment labeling for feedback spreadsheets
+#rows are packed into token-budgeted batches under stable row ids, the batches
+#run concurrently under a shared rate limit, and the model answers each row
+#with just "<id>:<P or N>" so even very large sheets get every row labeled
+
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from feedback_store import STORE_PATH, lookup, row_hashes, save
+from rate_limit import RateLimiter
+
+LABELS = {"p": "Positive", "n": "Negative", "positive": "Positive", "negative": "Negative"}
+UNLABELED = "Unlabeled"
+#rough token estimate, good enough for budgeting prompts
+CHARS_PER_TOKEN = 4
+ROW_OVERHEAD_TOKENS = 4
+OUTPUT_TOKENS_PER_ROW = 6
+MAX_CELL_CHARS = 1000
+#stored labels are only reused by the same prompt; bump this when label_prompt changes
+LABEL_SCOPE = "sentiment:v1"
+
+LABEL_LINE = re.compile(r"(\d+)\s*[:=|,\-\t]\s*[\"']?(positive|negative|p|n)\b", re.IGNORECASE)
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+#one line of text per row, the non-empty cells joined together
+def row_texts(df):
+    cells = df.astype(str).where(df.notna(), "")
+    return pd.Series(
+        [" | ".join(cell.strip() for cell in row if cell.strip()) for row in cells.itertuples(index=False)],
+        index=df.index,
+    )
+
+
+def make_batches(texts, token_budget=3000, max_rows=100):
+    batches = []
+    current, used = [], 0
+    for row_id, text in texts.items():
+        text = " ".join(str(text).split())[:MAX_CELL_CHARS]
+        if not text:
+            continue
+        cost = estimate_tokens(text) + ROW_OVERHEAD_TOKENS
+        if current and (used + cost > token_budget or len(current) >= max_rows):
+            batches.append(current)
+            current, used = [], 0
+        current.append((row_id, text))
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def label_prompt(batch):
+    rows = "\n".join(f"{row_id}: {text}" for row_id, text in batch)
+    return [{
+        "role": "user",
+        "content": [
+            {"type": "text", "text": (
+                "Label the sentiment of each numbered customer feedback row below as P (positive) or N (negative).\n"
+                "Reply with exactly one line per row in the form <id>:<P or N>, for example 12:P. "
+                "Do not add explanations, headings or code.\n\n"
+                f"{rows}"
+            )}
+        ]
+    }]
+
+
+#only ids that were actually in the batch are accepted
+def parse_labels(reply, row_ids):
+    labels = {}
+    for row_id, label in LABEL_LINE.findall(str(reply)):
+        row_id = int(row_id)
+        if row_id in row_ids and row_id not in labels:
+            labels[row_id] = LABELS[label.lower()]
+    return labels
+
+
+#labels every row of `texts` (a Series indexed by integer row id) with query_fn(messages, max_tokens).
+#rows the model skipped are retried in smaller batches; `progress(done, total)` and
+#`on_batch(labels)` are called from the calling thread as batches complete
+def label_rows(texts, query_fn, token_budget=3000, max_rows=100, max_workers=4,
+               requests_per_minute=60, retries=1, progress=None, on_batch=None):
+    limiter = RateLimiter(requests_per_minute)
+    batches = make_batches(texts, token_budget, max_rows)
+    total = sum(len(batch) for batch in batches)
+    labels = {}
+    errors = []
+    stats = {"rows": len(texts), "batches": len(batches), "calls": 0, "failed_calls": 0}
+
+    def run(batch):
+        limiter.wait()
+        reply = query_fn(label_prompt(batch), max_tokens=len(batch) * OUTPUT_TOKENS_PER_ROW + 50)
+        return parse_labels(reply, {row_id for row_id, _ in batch})
+
+    pending = batches
+    for attempt in range(retries + 1):
+        missed = []
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {pool.submit(run, batch): batch for batch in pending}
+            for future in as_completed(futures):
+                batch = futures[future]
+                stats["calls"] += 1
+                try:
+                    got = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    stats["failed_calls"] += 1
+                    got = {}
+                labels.update(got)
+                if on_batch and got:
+                    on_batch(got)
+                missed += [(row_id, text) for row_id, text in batch if row_id not in got]
+                if progress:
+                    progress(len(labels), total)
+        finally:
+            #on an interrupt, queued batches are dropped instead of run to the end;
+            #whatever on_batch already saved is kept
+            pool.shutdown(cancel_futures=True)
+        if not missed or attempt == retries:
+            break
+        retry_texts = pd.Series(dict(missed))
+        pending = make_batches(retry_texts, token_budget, max(1, max_rows // 2))
+
+    #nothing came back at all, most likely credentials or the endpoint
+    if errors and not labels:
+        raise errors[0]
+    stats["labeled"] = len(labels)
+    return pd.Series(labels, dtype=object).reindex(texts.index), stats
+
+
+#label_rows behind the row store: rows labeled in an earlier upload are reused,
+#repeated rows are sent once, and every finished batch is saved straight away
+def label_feedback(texts, query_fn, scope=LABEL_SCOPE, store_path=STORE_PATH, **options):
+    texts = texts.fillna("").astype(str)
+    present = texts.str.strip() != ""
+    hashes = row_hashes(texts)
+    stored = lookup(hashes[present], scope, store_path)
+    known = hashes.isin(stored.keys())
+    todo = texts[present & ~known & ~hashes.duplicated()]
+
+    def remember(got):
+        save({hashes[row_id]: label for row_id, label in got.items()}, scope, store_path)
+
+    new_labels, stats = label_rows(todo, query_fn, on_batch=remember, **options)
+    by_hash = dict(stored)
+    by_hash.update({hashes[row_id]: label for row_id, label in new_labels.dropna().items()})
+    labels = hashes.map(by_hash).where(present)
+
+    stats.update({
+        "rows": len(texts),
+        "sent": len(todo),
+        "reused": int((present & known).sum()),
+        "labeled": int(labels.notna().sum()),
+    })
+    stats["reuse_ratio"] = stats["reused"] / max(int(present.sum()), 1)
+    return labels, stats
+
+
+def merge_labels(df, labels, column="Sentiment"):
+    labeled = df.copy()
+    labeled[column] = labels.reindex(df.index).fillna(UNLABELED)
+    return labeled
+
+
+# Local aggregation, so counts never depend on the model doing arithmetic
+def sentiment_counts(labeled, column="Sentiment"):
+    counts = labeled[column].value_counts().rename_axis("Label").reset_index(name="Count")
+    counts["Percent"] = (100 * counts["Count"] / max(len(labeled), 1)).round(1)
+    return counts
+
+
+#sentiment split for every low-cardinality column (region, product, channel...),
+#free-text columns are skipped even when they repeat a lot
+def column_breakdowns(labeled, column="Sentiment", max_categories=20, max_value_chars=25):
+    breakdowns = {}
+    for name in labeled.columns:
+        if name == column:
+            continue
+        values = labeled[name]
+        n_unique = values.nunique(dropna=True)
+        if n_unique < 2 or n_unique > max_categories or n_unique == len(values):
+            continue
+        if values.dropna().astype(str).str.len().mean() > max_value_chars:
+            continue
+        table = pd.crosstab(values, labeled[column])
+        table["Total"] = table.sum(axis=1)
+        if "Positive" in table:
+            table["Positive %"] = (100 * table["Positive"] / table["Total"]).round(1)
+        breakdowns[name] = table.sort_values("Total", ascending=False)
+    return breakdowns
+
+
+#the most repeated comments for each label, then a seeded sample of distinct ones
+def representative_examples(labeled, texts, column="Sentiment", per_label=5, seed=0):
+    examples = {}
+    frame = pd.DataFrame({"label": labeled[column], "text": texts.reindex(labeled.index)})
+    frame = frame[frame["text"].fillna("").str.strip() != ""]
+    for label, group in frame.groupby("label"):
+        if label == UNLABELED:
+            continue
+        counts = group["text"].str.slice(0, 300).value_counts()
+        repeated = counts[counts > 1].index[:per_label].tolist()
+        rest = counts.index.difference(repeated).to_series()
+        rest = rest.sample(min(per_label - len(repeated), len(rest)), random_state=seed).tolist() if len(rest) else []
+        examples[label] = repeated + rest
+    return examples
+
+
+def summary_prompt(counts, breakdowns, examples):
+    lines = ["Sentiment counts (computed from every row):"]
+    lines += [f"- {row.Label}: {row.Count} ({row.Percent}%)" for row in counts.itertuples()]
+    for name, table in breakdowns.items():
+        lines.append(f"\nSentiment by {name}:")
+        lines += [f"- {value}: " + ", ".join(f"{col} {table.loc[value, col]}" for col in table.columns)
+                  for value in table.index[:10]]
+    for label, texts in examples.items():
+        lines.append(f"\nRepresentative {label} comments:")
+        lines += [f"- {text}" for text in texts]
+    return "\n".join(lines)
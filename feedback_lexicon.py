@@ -0,0 +1,116 @@
+# Local sentiment pre-scoring for feedback rows
+#every row is scored against a small weighted word list in one vectorized pass
+#(with "not good" style negation flipped), rows that are clearly positive or
+#negative are labeled locally and only the ambiguous ones go to the model; a
+#held-out sample of the local labels is also sent, to measure agreement
+
+import numpy as np
+import pandas as pd
+
+from feedback_labeling import LABEL_SCOPE, label_feedback
+from feedback_store import STORE_PATH
+
+#|positive - negative| / (positive + negative + 1): one clean hit scores 0.5,
+#mixed rows fall towards 0 and nothing reaches 1, so 1.0 sends every row
+THRESHOLD = 0.5
+HOLDOUT_SHARE = 0.05
+HOLDOUT_MIN = 50
+HOLDOUT_MAX = 500
+#how many words back a negation still flips the sentiment word ("not very good")
+NEGATION_WINDOW = 2
+
+WORD = r"[^\W\d_]+(?:'[^\W\d_]+)?"
+
+POSITIVE = {
+    "good": 1, "great": 1.5, "excellent": 2, "amazing": 2, "awesome": 2, "fantastic": 2, "wonderful": 2,
+    "outstanding": 2, "perfect": 2, "love": 2, "loved": 2, "loves": 2, "best": 2, "nice": 1, "friendly": 1,
+    "helpful": 1, "happy": 1, "pleased": 1, "satisfied": 1, "recommend": 1, "recommended": 1, "fast": 1,
+    "quick": 1, "quickly": 1, "easy": 1, "clean": 1, "fresh": 1, "polite": 1, "professional": 1,
+    "efficient": 1, "reliable": 1, "smooth": 1, "enjoyed": 1, "enjoy": 1, "thanks": 1, "thank": 1,
+    "impressed": 1.5, "delicious": 1.5, "superb": 2, "brilliant": 2, "pleasant": 1, "courteous": 1,
+    "convenient": 1, "affordable": 1, "worth": 1, "beautiful": 1, "comfortable": 1, "attentive": 1,
+    "responsive": 1, "knowledgeable": 1, "exceeded": 1.5, "glad": 1, "seamless": 1, "fair": 0.5,
+}
+
+NEGATIVE = {
+    "bad": 1, "poor": 1.5, "terrible": 2, "awful": 2, "horrible": 2, "worst": 2, "hate": 2, "hated": 2,
+    "disappointing": 1.5, "disappointed": 1.5, "rude": 1.5, "slow": 1, "late": 1, "dirty": 1.5,
+    "broken": 1.5, "expensive": 1, "overpriced": 1.5, "unhelpful": 1.5, "useless": 2, "waste": 1.5,
+    "wasted": 1.5, "never": 0.5, "problem": 1, "problems": 1, "issue": 1, "issues": 1, "complaint": 1,
+    "cold": 0.5, "wrong": 1, "missing": 1, "lost": 1, "delay": 1, "delayed": 1, "delays": 1, "refund": 0.5,
+    "cancelled": 1, "canceled": 1, "annoying": 1.5, "frustrating": 1.5, "frustrated": 1.5, "angry": 1.5,
+    "unacceptable": 2, "mediocre": 1, "confusing": 1, "difficult": 1, "crash": 1, "crashes": 1,
+    "crashed": 1, "bug": 1, "buggy": 1.5, "noisy": 1, "smelly": 1.5, "stale": 1, "unprofessional": 1.5,
+    "ignored": 1.5, "incompetent": 2, "scam": 2, "avoid": 1.5, "lacking": 1, "unfriendly": 1.5,
+}
+
+NEGATIONS = {
+    "not", "no", "never", "nothing", "hardly", "barely", "without", "cannot", "nor",
+    "don't", "doesn't", "didn't", "isn't", "wasn't", "aren't", "weren't", "won't", "wouldn't",
+    "can't", "couldn't", "shouldn't", "haven't", "hasn't", "hadn't",
+    "dont", "doesnt", "didnt", "isnt", "wasnt", "arent", "werent", "wont", "wouldnt", "cant", "couldnt",
+}
+
+WEIGHTS = pd.Series({**{word: w for word, w in POSITIVE.items()}, **{word: -w for word, w in NEGATIVE.items()}})
+
+
+#one row per text: positive and negative weight, confidence and the local label (None when unsure)
+def prescore(texts, threshold=THRESHOLD):
+    texts = texts.fillna("").astype(str)
+    words = texts.str.lower().str.replace("’", "'", regex=False).str.findall(WORD).explode().dropna()
+    row = words.index.to_numpy()
+
+    weight = words.map(WEIGHTS).fillna(0).to_numpy()
+    #a negation a word or two back, within the same row, flips the weight
+    is_negation = words.isin(NEGATIONS).to_numpy()
+    negated = np.zeros(len(words), dtype=bool)
+    for back in range(1, NEGATION_WINDOW + 1):
+        same_row = np.zeros(len(words), dtype=bool)
+        same_row[back:] = row[back:] == row[:-back]
+        previous = np.zeros(len(words), dtype=bool)
+        previous[back:] = is_negation[:-back]
+        negated |= same_row & previous
+    #"never" is both a negation and mildly negative, it shouldn't count twice
+    weight = np.where(is_negation & (weight < 0), 0, weight)
+    weight = np.where(negated, -weight, weight)
+
+    hits = pd.DataFrame({"positive": weight.clip(min=0), "negative": (-weight).clip(min=0)}, index=words.index)
+    scores = hits.groupby(level=0).sum().reindex(texts.index, fill_value=0.0)
+    diff = scores["positive"] - scores["negative"]
+    scores["confidence"] = diff.abs() / (scores["positive"] + scores["negative"] + 1)
+    scores["label"] = np.where(diff > 0, "Positive", "Negative")
+    scores["label"] = scores["label"].where(scores["confidence"] >= threshold)
+    return scores
+
+
+#label_feedback for just the rows the lexicon can't call; a seeded sample of the
+#locally labeled rows goes to the model too and is reported as agreement
+def label_with_lexicon(texts, query_fn, threshold=THRESHOLD, holdout_share=HOLDOUT_SHARE,
+                       scope=LABEL_SCOPE, store_path=STORE_PATH, seed=0, **options):
+    texts = texts.fillna("").astype(str)
+    present = texts.str.strip() != ""
+    local = prescore(texts, threshold)["label"].where(present)
+    confident = local.dropna().index
+
+    n_holdout = min(len(confident), HOLDOUT_MAX, max(HOLDOUT_MIN, round(holdout_share * len(confident))))
+    holdout = pd.Series(confident).sample(n_holdout, random_state=seed) if n_holdout else pd.Series([], dtype=object)
+    to_model = present & (local.isna() | texts.index.isin(holdout))
+
+    model_labels, stats = label_feedback(texts[to_model], query_fn, scope=scope, store_path=store_path, **options)
+    #the model's answer wins on the held-out rows, it's what was paid for
+    labels = local.copy()
+    labels.update(model_labels.dropna())
+
+    compared = model_labels.reindex(holdout).dropna()
+    #both shares are of every non-empty row, not just the ones label_feedback saw,
+    #so they can be read side by side
+    stats.update({
+        "rows": len(texts),
+        "labeled": int(labels.notna().sum()),
+        "local": int(len(confident) - len(compared)),
+        "local_share": (len(confident) - len(compared)) / max(int(present.sum()), 1),
+        "reuse_ratio": stats["reused"] / max(int(present.sum()), 1),
+        "holdout": len(compared),
+        "agreement": float((local[compared.index] == compared).mean()) if len(compared) else None,
+    })
+    return labels, stats
@@ -0,0 +1,79 @@
+# Row-level result store for feedback re-uploads
+#results are keyed by a hash of the row's normalized text plus a scope naming
+#what produced them (which app, model and prompt), so a re-uploaded export
+#only has to send new or edited rows to the model
+
+import hashlib
+import sqlite3
+import time
+
+import pandas as pd
+
+STORE_PATH = "feedback_results.sqlite"
+#sqlite's host-parameter limit is 999 on older builds
+CHUNK = 500
+
+
+#case and spacing changes alone don't make a row "new"
+def normalize_text(text):
+    return " ".join(str(text).lower().split())
+
+
+def row_hashes(texts):
+    return pd.Series(
+        [hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).hexdigest() for text in texts],
+        index=texts.index,
+    )
+
+
+#one hash for a whole set of rows, independent of their order
+def set_hash(hashes):
+    digest = hashlib.blake2b(digest_size=16)
+    for value in sorted(set(hashes)):
+        digest.update(value.encode("ascii"))
+    return digest.hexdigest()
+
+
+def connect(path=STORE_PATH):
+    conn = sqlite3.connect(path, timeout=30)
+    #lets several sessions read while one writes
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS results ("
+        "scope TEXT NOT NULL, row_hash TEXT NOT NULL, result TEXT, updated REAL, "
+        "PRIMARY KEY (scope, row_hash))"
+    )
+    return conn
+
+
+def lookup(hashes, scope, path=STORE_PATH):
+    hashes = list(dict.fromkeys(hashes))
+    found = {}
+    conn = connect(path)
+    try:
+        for start in range(0, len(hashes), CHUNK):
+            chunk = hashes[start:start + CHUNK]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT row_hash, result FROM results WHERE scope = ? AND row_hash IN ({marks})",
+                [scope, *chunk],
+            )
+            found.update(rows)
+    finally:
+        conn.close()
+    return found
+
+
+def save(results, scope, path=STORE_PATH):
+    if not results:
+        return
+    now = time.time()
+    conn = connect(path)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO results (scope, row_hash, result, updated) VALUES (?, ?, ?, ?)",
+                [(scope, row_hash, result, now) for row_hash, result in results.items()],
+            )
+    finally:
+        conn.close()
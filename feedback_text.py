@@ -0,0 +1,104 @@
+# Turns a feedback sheet into compact prompt text
+#only the free-text feedback column(s) are sent, one numbered line per distinct
+#comment, with empty rows dropped, repeats counted and very long ones cut short
+
+import re
+
+import pandas as pd
+
+from feedback_ingest import iter_cells
+from feedback_labeling import CHARS_PER_TOKEN, estimate_tokens
+from feedback_store import normalize_text
+
+SAMPLE_ROWS = 2000
+MAX_CHARS = 300
+MIN_WORDS = 3
+
+EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+URL = re.compile(r"^(https?://|www\.)", re.IGNORECASE)
+NUMBER = re.compile(r"^[\s$€£%+\-.,:/\d]+$")
+LETTERS = re.compile(r"[^\W\d_]")
+
+
+#scores every text column on how much it looks like prose: several words per
+#cell, mostly distinct values, and not emails, links, numbers, ids or dates
+def score_columns(df):
+    scores = {}
+    for column in df.columns:
+        values = df[column]
+        if not (values.dtype == object or pd.api.types.is_string_dtype(values)):
+            continue
+        sample = values.dropna().astype(str).str.strip()
+        sample = sample[sample != ""].head(SAMPLE_ROWS)
+        if sample.empty:
+            continue
+        if sample.str.match(EMAIL).mean() > 0.5 or sample.str.match(URL).mean() > 0.5:
+            continue
+        if sample.str.match(NUMBER).mean() > 0.5 or not sample.str.contains(LETTERS).mean() > 0.5:
+            continue
+        if pd.to_datetime(sample.head(200), errors="coerce", format="mixed").notna().mean() > 0.8:
+            continue
+        words = sample.str.split().str.len().mean()
+        if words < MIN_WORDS:
+            continue
+        distinct = sample.nunique() / len(sample)
+        scores[column] = words * (0.5 + distinct)
+    return pd.Series(scores, dtype=float).sort_values(ascending=False)
+
+
+def detect_feedback_columns(df, max_columns=2):
+    scores = score_columns(df)
+    if scores.empty:
+        return []
+    #a second column only counts if it is nearly as wordy as the best one
+    return [column for column in scores.index[:max_columns] if scores[column] >= scores.iloc[0] / 2]
+
+
+#yields "1. comment" lines; repeated comments appear once with their count, e.g.
+#"3. Too slow (x12)", and stats records what was dropped or cut along the way
+def iter_feedback_lines(df, columns, max_chars=MAX_CHARS, stats=None):
+    stats = stats if stats is not None else {}
+    cells = df[columns].astype(object).where(df[columns].notna(), "")
+    texts = pd.Series(
+        [" | ".join(" ".join(str(value).split()) for value in row if str(value).strip())
+         for row in cells.itertuples(index=False, name=None)],
+        index=df.index, dtype=object,
+    )
+    present = texts != ""
+    keys = texts.map(normalize_text)
+    counts = keys[present].value_counts()
+    first = present & ~keys.duplicated()
+    stats.update({
+        "rows": len(df),
+        "lines": 0,
+        "empty": int((~present).sum()),
+        "duplicates": int(present.sum() - first.sum()),
+        "truncated": 0,
+    })
+    for text, key in zip(texts[first], keys[first]):
+        if len(text) > max_chars:
+            text = text[:max_chars].rstrip() + "…"
+            stats["truncated"] += 1
+        stats["lines"] += 1
+        repeats = f" (x{counts[key]})" if counts[key] > 1 else ""
+        yield f"{stats['lines']}. {text}{repeats}"
+
+
+def serialize_feedback(df, columns, max_chars=MAX_CHARS):
+    stats = {}
+    text = "\n".join(iter_feedback_lines(df, columns, max_chars, stats))
+    return text, stats
+
+
+#token estimate of the old every-cell flattening, measured without building it
+def flattened_tokens(df):
+    chars = 0
+    for cell in iter_cells(df):
+        chars += len(cell) + 1
+    return chars // CHARS_PER_TOKEN + 1
+
+
+def token_savings(df, text):
+    before = flattened_tokens(df)
+    after = estimate_tokens(text)
+    return {"before": before, "after": after, "saved": 1 - after / max(before, 1)}
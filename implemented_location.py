@@ -3,9 +3,7 @@ import base64
 from PIL import Image
 import requests
 import PyPDF2
-
-from io import BytesIO
-from fpdf import FPDF
+from datetime import datetime
 
 import requests
 import pandas as pd
@@ -13,21 +11,25 @@ import pydeck as pdk
 
 from streamlit_geolocation import streamlit_geolocation
 
+from overpass_client import default_client
+from report_batch import FORMATS, export_reports
+from repair_estimate import estimate_frame, estimate_repair, estimate_text
+from report_pdf import create_pdf, start_report
+from repair_shops import nearby_shops, offline_index
+
 
 api_key = st.secrets["IBM_API_KEY"]
 project_id = st.secrets["PROJECT_ID"]
 
-
-def create_pdf(content, title="Analysis Result"):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Times", size=12)
-    pdf.cell(200, 10, txt=title, ln=True, align="C")
-    pdf.ln(10)
-    for line in content.split('\n'):
-        pdf.multi_cell(0, 10, line)
-    pdf_bytes = pdf.output(dest='S').encode('latin1') 
-    return BytesIO(pdf_bytes)
+#largest slider radius; shops are fetched for this once and filtered for smaller ones
+MAX_MILES = 3.0
+MAX_RADIUS = int(MAX_MILES * 1609.34)
+#how many of the nearest shops the table and map show
+SHOW_NEAREST = [10, 25, 50, 100, "All"]
+#nearest shops listed in the PDF report
+REPORT_SHOPS = 10
+#analyses kept for the batch export, oldest dropped first
+MAX_HISTORY = 100
 
 
 def convert_image_to_base64(uploaded_file):
@@ -86,6 +88,100 @@ def query_model(messages):
         raise Exception(f"Non-200 response: {response.text}")
     return response.json()['choices'][0]['message']['content']
 
+#carries shops that came partly from old saved tiles out of the cached function
+class StaleShops(Exception):
+    def __init__(self, shops):
+        super().__init__("some shops are from an older saved copy")
+        self.shops = shops
+
+
+#the shops for a point and radius, kept in memory so a fragment rerun with the
+#same inputs redraws without touching the tiles; a stale answer is raised instead
+#of returned, so it isn't kept and the next rerun asks OpenStreetMap again
+@st.cache_data(show_spinner=False, ttl=600, max_entries=64)
+def cached_shops(lat, lon, radius):
+    df = nearby_shops(lat, lon, radius, prefetch_radius=MAX_RADIUS)
+    if df.attrs.get("stale"):
+        raise StaleShops(df)
+    return df
+
+
+def find_shops(lat, lon, radius):
+    try:
+        return cached_shops(lat, lon, radius)
+    except StaleShops as e:
+        return e.shops
+
+
+#runs as its own fragment: "Get Location" and the sliders rerun only this function,
+#never the uploads, the analysis or the PDF download above it
+@st.fragment
+def repair_shop_map():
+    #using geoloation from streamlit_geolocation package to get the user's location
+    location = streamlit_geolocation()
+
+    if location and location['latitude'] and location['longitude']:
+        lat, lon = location['latitude'], location['longitude']
+        st.success(f"📍 Your location: {lat:.5f}, {lon:.5f}")
+
+
+        #don't mess with this, it needs to be in Meters for the query 
+        miles = st.slider("Search radius (miles)", 0.3, MAX_MILES, 1.2, 0.1)
+        radius = int(miles * 1609.34)
+        shown = st.select_slider("Show nearest", options=SHOW_NEAREST, value=25)
+
+        #shops come from cached map tiles covering the largest radius, so moving the
+        #slider only re-filters them locally
+        try:
+            df = find_shops(lat, lon, radius)
+        except requests.RequestException:
+            st.error("Couldn't reach OpenStreetMap right now, please try again in a minute.")
+            df = pd.DataFrame(columns=["name", "lat", "lon", "distance_m"])
+        if offline_index() is not None:
+            st.caption("Shops from the offline index built from an OpenStreetMap extract")
+        elif df.attrs.get("stale"):
+            st.caption("OpenStreetMap isn't answering, some shops are from an older saved copy")
+
+
+        #displayiing them on a map, while displaying he number 
+        #shops arrive sorted by distance, so the table and map show the nearest ones
+        if len(df):
+            nearest = df if shown == "All" else df.head(shown)
+            st.subheader(f"Found {len(df)} car repair shops" + (f", showing the nearest {len(nearest)}" if len(nearest) < len(df) else ""))
+            table = nearest[["name", "lat", "lon"]].assign(**{"distance (mi)": nearest["distance_m"] / 1609.34})
+            st.dataframe(table[["name", "distance (mi)", "lat", "lon"]].round({"distance (mi)": 2}), hide_index=True)
+            #picked up by the PDF report on the next full rerun
+            st.session_state["report_shops"] = list(zip(df["name"].head(REPORT_SHOPS), df["distance_m"].head(REPORT_SHOPS)))
+
+            st.pydeck_chart(pdk.Deck(
+                initial_view_state=pdk.ViewState(latitude=lat, longitude=lon, zoom=13),
+                layers=[
+                    pdk.Layer(
+                        "ScatterplotLayer",
+                        data=nearest,
+                        get_position='[lon, lat]',
+                        get_fill_color='[255, 0, 0, 200]',
+                        get_radius=100,
+                    )
+                ]
+            ))
+        else:
+            st.warning("No car repair shops found nearby. Try increasing the search radius.")
+        if offline_index() is None:
+            with st.expander("OpenStreetMap servers"):
+                st.dataframe(default_client().stats(), hide_index=True)
+    else:
+        st.info("Click the 'Get Location' button above to allow the app to find nearby car repair shops.")
+
+
+#kept in the session for the batch export
+def remember_analysis(item):
+    item["title"] = f"{item['title']} ({datetime.now():%Y-%m-%d %H:%M})"
+    history = st.session_state.setdefault("history", [])
+    history.append(item)
+    del history[:-MAX_HISTORY]
+
+
 def main():
     st.title("Analyze Image or Document Streamlit Web Application")
 
@@ -105,6 +201,9 @@ def main():
         st.subheader("Document Preview")
         st.write(text_preview[:1000] + ("..." if len(text_preview) > 1000 else ""))
 
+    #line items as JSON, checked and added up locally, instead of a prose answer
+    itemized = st.toggle("Itemized estimate", help="Parts and labor per item with computed totals; "
+                                                   "a photo that was already estimated isn't sent again")
     analyze_button = st.button("Analyze")
 
     if "ai_response" not in st.session_state:
@@ -122,12 +221,29 @@ def main():
                     {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
                 ]
             }
+            estimate = None
             with st.spinner("Analyzing image..."):
-                ai_response = query_model([system_prompt])
+                if itemized:
+                    try:
+                        estimate = estimate_repair(uploaded_image.getvalue(), query_model, mime=uploaded_image.type)
+                    except ValueError as e:
+                        st.error(f"The model's estimate couldn't be read, please try again. ({e})")
+                        st.stop()
+                    ai_response = estimate_text(estimate)
+                else:
+                    ai_response = query_model([system_prompt])
 
             st.session_state["ai_response"] = ai_response
+            #the report shows a thumbnail of the analyzed photo
+            st.session_state["report_image"] = uploaded_image.getvalue()
+            #the PDF renders in the background while the result is shown
+            start_report(ai_response, image=st.session_state["report_image"], shops=st.session_state.get("report_shops"))
+            remember_analysis({"title": f"Image analysis: {uploaded_image.name}", "content": ai_response,
+                               "image": st.session_state["report_image"], "shops": st.session_state.get("report_shops")})
 
             st.subheader("Analysis Result")
+            if estimate:
+                st.dataframe(estimate_frame(estimate), hide_index=True)
             st.write(ai_response)
         elif doc_uploaded and not file_uploaded:
             #doc analysis
@@ -143,6 +259,11 @@ def main():
                 ai_response = query_model([system_prompt])
 
             st.session_state["ai_response"] = ai_response
+            st.session_state["report_image"] = None
+            #the PDF renders in the background while the result is shown
+            start_report(ai_response, shops=st.session_state.get("report_shops"))
+            remember_analysis({"title": f"Document analysis: {uploaded_doc.name}", "content": ai_response,
+                               "shops": st.session_state.get("report_shops")})
 
             st.subheader("Analysis Result")
             st.write(ai_response)
@@ -153,79 +274,29 @@ def main():
 
     #only add the button if the repsonse is creatred from the interface in the first plcae
     if st.session_state.get("ai_response"):
-        pdf_bytes = create_pdf(st.session_state["ai_response"])
+        #built once per distinct response, reruns get the same bytes back
+        pdf_bytes = create_pdf(st.session_state["ai_response"], image=st.session_state.get("report_image"),
+                               shops=st.session_state.get("report_shops"))
         st.download_button(
             label="Download Output",
             data=pdf_bytes,
             file_name="analysis_result.pdf",
             mime="application/pdf"
         )
-    
-
-
-        #using geoloation from streamlit_geolocation package to get the user's location
-    location = streamlit_geolocation()
-
-    if location and location['latitude'] and location['longitude']:
-        lat, lon = location['latitude'], location['longitude']
-        st.success(f"📍 Your location: {lat:.5f}, {lon:.5f}")
-
-
-        #don't mess with this, it needs to be in Meters for the query 
-        miles = st.slider("Search radius (miles)", 0.3, 3.0, 1.2, 0.1)
-        radius = int(miles * 1609.34)
-
-        #find car repair shops, query can be changed [radius -> meters for openpass]
-        query = f"""
-        [out:json];
-        (
-        node["shop"="car_repair"](around:{radius},{lat},{lon});
-        way["shop"="car_repair"](around:{radius},{lat},{lon});
-        relation["shop"="car_repair"](around:{radius},{lat},{lon});
-        );
-        out center;
-        """
-
-        #overpass endpoint
-        url = "https://overpass-api.de/api/interpreter"
-        resp = requests.post(url, data={"data": query})
-        data = resp.json()
-
-        repair_shops = []
-        for el in data.get("elements", []):
-            tags = el.get("tags", {})
-            name = tags.get("name", "Unnamed")
-            loc = el.get("center", el)
-            repair_shops.append({
-                "name": name,
-                "lat": loc["lat"],
-                "lon": loc["lon"],
-            })
-
-
-        #displayiing them on a map, while displaying he number 
-        if repair_shops:
-            df = pd.DataFrame(repair_shops)
-            st.subheader(f"Found {len(df)} car repair shops")
-            st.dataframe(df)
-
-            st.pydeck_chart(pdk.Deck(
-                initial_view_state=pdk.ViewState(latitude=lat, longitude=lon, zoom=13),
-                layers=[
-                    pdk.Layer(
-                        "ScatterplotLayer",
-                        data=df,
-                        get_position='[lon, lat]',
-                        get_fill_color='[255, 0, 0, 200]',
-                        get_radius=100,
-                    )
-                ]
-            ))
-        else:
-            st.warning("No car repair shops found nearby. Try increasing the search radius.")
-    else:
-        st.info("Click the 'Get Location' button above to allow the app to find nearby car repair shops.")
 
+    #every analysis of this session in one download, rendered only when asked for
+    history = st.session_state.get("history", [])
+    if len(history) > 1:
+        with st.expander(f"Export all {len(history)} analyses"):
+            fmt = st.radio("Format", list(FORMATS), horizontal=True,
+                           format_func=lambda f: "One PDF" if f == "pdf" else "ZIP of PDFs")
+            if st.button("Prepare export"):
+                with st.spinner(f"Rendering {len(history)} reports..."):
+                    with export_reports(history, fmt) as export:
+                        st.download_button("Download export", data=export, file_name=f"analyses.{fmt}",
+                                           mime=FORMATS[fmt], on_click="ignore")
+
+    repair_shop_map()
 
 
 if __name__ == "__main__":
@@ -4,6 +4,14 @@ import pandas as pd
 import pydeck as pdk
 from streamlit_geolocation import streamlit_geolocation
 
+from overpass_client import default_client
+from repair_shops import nearby_shops, offline_index
+
+#largest slider radius; shops are fetched for this once and filtered for smaller ones
+MAX_RADIUS = 5000
+#how many of the nearest shops the table and map show
+SHOW_NEAREST = [10, 25, 50, 100, "All"]
+
 st.set_page_config(page_title="Nearby Repair Shops", layout="wide")
 st.title("🔧 Car Repair Shops Near Me (OpenStreetMap — No API Key)")
 
@@ -14,48 +22,36 @@ if location and location['latitude'] and location['longitude']:
     lat, lon = location['latitude'], location['longitude']
     st.success(f"📍 Your location: {lat:.5f}, {lon:.5f}")
 
-    radius = st.slider("Search radius (meters)", 500, 5000, 2000, 100)
-
-    #find car repair shops, query can be changed
-    query = f"""
-    [out:json];
-    (
-      node["shop"="car_repair"](around:{radius},{lat},{lon});
-      way["shop"="car_repair"](around:{radius},{lat},{lon});
-      relation["shop"="car_repair"](around:{radius},{lat},{lon});
-    );
-    out center;
-    """
-
-    #overpass endpoint
-    url = "https://overpass-api.de/api/interpreter"
-    resp = requests.post(url, data={"data": query})
-    data = resp.json()
+    radius = st.slider("Search radius (meters)", 500, MAX_RADIUS, 2000, 100)
+    shown = st.select_slider("Show nearest", options=SHOW_NEAREST, value=25)
 
-    repair_shops = []
-    for el in data.get("elements", []):
-        tags = el.get("tags", {})
-        name = tags.get("name", "Unnamed")
-        loc = el.get("center", el)
-        repair_shops.append({
-            "name": name,
-            "lat": loc["lat"],
-            "lon": loc["lon"],
-        })
+    #shops come from cached map tiles covering the largest radius, so moving the
+    #slider only re-filters them locally
+    try:
+        df = nearby_shops(lat, lon, radius, prefetch_radius=MAX_RADIUS)
+    except requests.RequestException:
+        st.error("Couldn't reach OpenStreetMap right now, please try again in a minute.")
+        df = pd.DataFrame(columns=["name", "lat", "lon", "distance_m"])
+    if offline_index() is not None:
+        st.caption("Shops from the offline index built from an OpenStreetMap extract")
+    elif df.attrs.get("stale"):
+        st.caption("OpenStreetMap isn't answering, some shops are from an older saved copy")
 
 
     #displayiing them on a map, while displaying he number 
-    if repair_shops:
-        df = pd.DataFrame(repair_shops)
-        st.subheader(f"Found {len(df)} car repair shop(s)")
-        st.dataframe(df)
+    #shops arrive sorted by distance, so the table and map show the nearest ones
+    if len(df):
+        nearest = df if shown == "All" else df.head(shown)
+        st.subheader(f"Found {len(df)} car repair shop(s)" + (f", showing the nearest {len(nearest)}" if len(nearest) < len(df) else ""))
+        table = nearest[["name", "distance_m", "lat", "lon"]].rename(columns={"distance_m": "distance (m)"})
+        st.dataframe(table.round({"distance (m)": 0}), hide_index=True)
 
         st.pydeck_chart(pdk.Deck(
             initial_view_state=pdk.ViewState(latitude=lat, longitude=lon, zoom=13),
             layers=[
                 pdk.Layer(
                     "ScatterplotLayer",
-                    data=df,
+                    data=nearest,
                     get_position='[lon, lat]',
                     get_fill_color='[255, 0, 0, 200]',
                     get_radius=120,
@@ -64,6 +60,9 @@ if location and location['latitude'] and location['longitude']:
         ))
     else:
         st.warning("No car repair shops found nearby. Try increasing the search radius.")
+    if offline_index() is None:
+        with st.expander("OpenStreetMap servers"):
+            st.dataframe(default_client().stats(), hide_index=True)
 else:
     st.info("Click the 'Get Location' button above to allow the app to find nearby car repair shops.")
 
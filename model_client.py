@@ -0,0 +1,81 @@
+# watsonx chat client for scripts, and for apps that make many calls per run
+#credentials come from the environment or .streamlit/secrets.toml, and one
+#IAM token is shared by every worker thread and refreshed shortly before it expires
+
+import os
+import threading
+import time
+import tomllib
+
+import requests
+
+AUTH_URL = "https://iam.cloud.ibm.com/identity/token"
+CHAT_URL = "https://us-south.ml.cloud.ibm.com/ml/v1/text/chat?version=2023-05-29"
+MODEL_ID = "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8"
+SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+#tokens last an hour; refresh this long before that
+REFRESH_MARGIN = 300
+REQUEST_TIMEOUT = 120
+
+
+#environment variables win over the secrets file, so a job can run without one
+def load_credentials(secrets_path=SECRETS_PATH):
+    secrets = {}
+    if os.path.exists(secrets_path):
+        with open(secrets_path, "rb") as f:
+            secrets = tomllib.load(f)
+    api_key = os.environ.get("IBM_API_KEY") or secrets.get("IBM_API_KEY")
+    project_id = os.environ.get("PROJECT_ID") or secrets.get("PROJECT_ID")
+    if not api_key or not project_id:
+        raise RuntimeError(f"Set IBM_API_KEY and PROJECT_ID in the environment or in {secrets_path}")
+    return api_key, project_id
+
+
+class ModelClient:
+    def __init__(self, api_key, project_id, model_id=MODEL_ID):
+        self.api_key = api_key
+        self.project_id = project_id
+        self.model_id = model_id
+        self.calls = 0
+        self._token = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+
+    def token(self):
+        with self._lock:
+            if self._token is None or time.time() > self._expires - REFRESH_MARGIN:
+                response = self._session.post(
+                    AUTH_URL,
+                    headers={"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"},
+                    data={"grant_type": "urn:ibm:params:oauth:grant-type:apikey", "apikey": self.api_key},
+                    verify=False, timeout=REQUEST_TIMEOUT,
+                )
+                if response.status_code != 200:
+                    raise Exception("Failed to get authentication token")
+                body = response.json()
+                self._token = body.get("access_token")
+                self._expires = time.time() + float(body.get("expires_in", 3600))
+            return self._token
+
+    #same signature label_rows expects: query_fn(messages, max_tokens=...)
+    def __call__(self, messages, max_tokens=2000):
+        body = {
+            "messages": messages,
+            "project_id": self.project_id,
+            "model_id": self.model_id,
+            "decoding_method": "greedy",
+            "repetition_penalty": 1,
+            "max_tokens": max_tokens,
+        }
+        headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.token()}",
+        }
+        response = self._session.post(CHAT_URL, headers=headers, json=body, timeout=REQUEST_TIMEOUT)
+        with self._lock:
+            self.calls += 1
+        if response.status_code != 200:
+            raise Exception(f"Non-200 response: {response.text}")
+        return response.json()["choices"][0]["message"]["content"]
@@ -0,0 +1,164 @@
+# Overpass API client that keeps working when one server is slow or down
+#every request has a connect/read timeout, a failing server hands over to the
+#next mirror, a slow one gets a second (hedged) request on a mirror with the
+#first answer winning, and a server that keeps failing is skipped for a while
+#(circuit breaker) so callers can fall back to cached tiles straight away
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+import requests
+
+#comma-separated OVERPASS_URLS overrides the list, first one is the primary
+MIRRORS = [
+    "https://overpass-api.de/api/interpreter",
+    "https://overpass.kumi.systems/api/interpreter",
+    "https://overpass.private.coffee/api/interpreter",
+]
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+#a mirror is asked too when the current request has taken this long
+HEDGE_AFTER = 4.0
+#consecutive failures that open a server's circuit, and how long it stays open
+FAILURES_TO_OPEN = 3
+OPEN_SECONDS = 120
+LATENCY_SAMPLES = 100
+
+
+#a RequestException, so callers that already catch network errors catch this too
+class OverpassUnavailable(requests.RequestException):
+    pass
+
+
+class EndpointError(Exception):
+    pass
+
+
+class Endpoint:
+    def __init__(self, url):
+        self.url = url
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.lock = threading.Lock()
+
+    #an open circuit skips the server until OPEN_SECONDS have passed, then requests
+    #go to it again; FAILURES_TO_OPEN more failures in a row open it again
+    def available(self):
+        return time.time() >= self.open_until
+
+    def record(self, seconds, ok):
+        with self.lock:
+            self.calls += 1
+            self.latencies.append(seconds)
+            if ok:
+                self.consecutive_failures = 0
+                return
+            #the failures that opened an expired circuit don't count towards the next one
+            if self.open_until and time.time() >= self.open_until:
+                self.consecutive_failures = 0
+                self.open_until = 0.0
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= FAILURES_TO_OPEN:
+                self.open_until = time.time() + OPEN_SECONDS
+
+
+class OverpassClient:
+    def __init__(self, urls=None, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), hedge_after=HEDGE_AFTER):
+        urls = urls or [url.strip() for url in os.environ.get("OVERPASS_URLS", "").split(",") if url.strip()] or MIRRORS
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.pool = ThreadPoolExecutor(max_workers=2 * len(self.endpoints), thread_name_prefix="overpass")
+        self.local = threading.local()
+
+    def session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    #any error answer counts against the server and hands over to the next one; a
+    #400 means Overpass couldn't parse the query, which no mirror will do better
+    def attempt(self, endpoint, query):
+        started = time.monotonic()
+        try:
+            resp = self.session().post(endpoint.url, data={"data": query}, timeout=self.timeout)
+            text = resp.text
+        except requests.RequestException as e:
+            endpoint.record(time.monotonic() - started, ok=False)
+            raise EndpointError(f"{endpoint.url}: {e}")
+        elapsed = time.monotonic() - started
+        if resp.status_code == 400:
+            endpoint.record(elapsed, ok=True)
+            raise OverpassUnavailable(f"{endpoint.url} rejected the query: {text[:200]}")
+        if resp.status_code >= 400:
+            endpoint.record(elapsed, ok=False)
+            raise EndpointError(f"{endpoint.url}: HTTP {resp.status_code}")
+        endpoint.record(elapsed, ok=True)
+        return text
+
+    #servers are tried in order; a failure moves on at once, a slow answer adds the next
+    #server after `hedge_after` seconds, and whichever answers first is returned
+    def post(self, query):
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.available()]
+        if not candidates:
+            raise OverpassUnavailable("every Overpass server is failing, try again in a few minutes")
+        pending, errors = {}, []
+        queue = iter(candidates)
+
+        def launch():
+            endpoint = next(queue, None)
+            if endpoint is not None:
+                pending[self.pool.submit(self.attempt, endpoint, query)] = endpoint
+            return endpoint is not None
+
+        launch()
+        while pending:
+            done, _ = wait(pending, timeout=self.hedge_after, return_when=FIRST_COMPLETED)
+            if not done:
+                launch()
+                continue
+            for future in done:
+                pending.pop(future)
+                try:
+                    return future.result()
+                except EndpointError as e:
+                    errors.append(str(e))
+                    if not pending:
+                        launch()
+        raise OverpassUnavailable("; ".join(errors))
+
+    def stats(self):
+        rows = []
+        for endpoint in self.endpoints:
+            latencies = np.array(endpoint.latencies) if endpoint.latencies else np.array([np.nan])
+            rows.append({
+                "server": endpoint.url,
+                "calls": endpoint.calls,
+                "failures": endpoint.failures,
+                "p50 (s)": round(float(np.percentile(latencies, 50)), 2),
+                "p95 (s)": round(float(np.percentile(latencies, 95)), 2),
+                "state": "ok" if endpoint.available() else "skipped",
+            })
+        return pd.DataFrame(rows)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+#one client per process, so every session shares the latency history and circuit state
+def default_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OverpassClient()
+        return _client
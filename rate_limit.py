@@ -0,0 +1,19 @@
+import threading
+import time
+
+
+#spaces calls evenly so no more than `rate` start in any `per` seconds,
+#shared by all the worker threads of a job
+class RateLimiter:
+    def __init__(self, rate, per=60.0):
+        self.interval = per / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
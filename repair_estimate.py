@@ -0,0 +1,152 @@
+# Structured repair estimates from a damage photo
+#the model is asked for JSON line items (part, action, parts cost, labor cost)
+#instead of prose, the answer is checked against a JSON schema and the totals
+#are added up here rather than trusted from the model. Validated estimates are
+#stored by a hash of the image, so reports, exports and comparisons of the
+#same photo never ask the model for the numbers again
+
+import base64
+import hashlib
+import json
+
+import pandas as pd
+from jsonschema import Draft7Validator
+
+from feedback_store import lookup, save
+
+STORE_PATH = "repair_estimates.sqlite"
+#stored estimates are only reused by the same prompt and schema; bump this when either changes
+ESTIMATE_SCOPE = "estimate:v1"
+#one more request, with the validation error, when the first answer doesn't fit the schema
+MAX_RETRIES = 1
+ACTIONS = ["repair", "replace", "refinish", "remove and install", "modify"]
+
+ESTIMATE_SCHEMA = {
+    "type": "object",
+    "required": ["damages", "items"],
+    "properties": {
+        "damages": {"type": "array", "items": {"type": "string", "minLength": 1}},
+        "items": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "required": ["part", "action", "parts_cost", "labor_cost"],
+                "properties": {
+                    "part": {"type": "string", "minLength": 1},
+                    "action": {"enum": ACTIONS},
+                    "parts_cost": {"type": "number", "minimum": 0},
+                    "labor_cost": {"type": "number", "minimum": 0},
+                },
+            },
+        },
+        "notes": {"type": "string"},
+    },
+}
+_validator = Draft7Validator(ESTIMATE_SCHEMA)
+
+ESTIMATE_PROMPT = (
+    "Based on this image, estimate how much money it would cost to repair this. "
+    "Answer with JSON only, no other text, in exactly this form:\n"
+    '{"damages": ["<each specific damage you see>"], '
+    '"items": [{"part": "<part name>", "action": "<one of: ' + ", ".join(ACTIONS) + '>", '
+    '"parts_cost": <US dollars>, "labor_cost": <US dollars>}], "notes": "<anything else>"}\n'
+    "List every piece that needs to be removed, fixed, replaced or modified as its own item. "
+    "Use one number for each cost, never a range, and don't be shy to overestimate."
+)
+
+
+def image_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def estimate_messages(data, mime="image/png"):
+    return [{
+        "role": "user",
+        "content": [
+            {"type": "text", "text": ESTIMATE_PROMPT},
+            {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{base64.b64encode(data).decode()}"}},
+        ],
+    }]
+
+
+#the JSON object in an answer, with or without a ```json fence or text around it
+def extract_json(text):
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise ValueError("the answer has no JSON object in it")
+    try:
+        return json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise ValueError(f"the answer isn't valid JSON: {e}")
+
+
+def validate_estimate(estimate):
+    errors = sorted(_validator.iter_errors(estimate), key=lambda e: list(e.path))
+    if errors:
+        where = "/".join(str(part) for part in errors[0].path) or "top level"
+        raise ValueError(f"{where}: {errors[0].message}")
+    return estimate
+
+
+#per-item and overall totals, always computed here from the validated costs
+def with_totals(estimate):
+    items = [dict(item, total=round(item["parts_cost"] + item["labor_cost"], 2)) for item in estimate["items"]]
+    parts = round(sum(item["parts_cost"] for item in items), 2)
+    labor = round(sum(item["labor_cost"] for item in items), 2)
+    return dict(estimate, items=items, totals={"parts": parts, "labor": labor, "total": round(parts + labor, 2)})
+
+
+def parse_estimate(text):
+    return with_totals(validate_estimate(extract_json(text)))
+
+
+#the validated estimate for an image, from the store when this photo was already
+#estimated under the same scope; raises ValueError when the model keeps answering
+#outside the schema. `key` is the image_hash of the original photo when `data` is
+#a resized copy of it, so the stored estimate doesn't depend on the resizing
+def estimate_repair(data, query_fn, mime="image/png", scope=ESTIMATE_SCOPE, store_path=STORE_PATH,
+                    max_retries=MAX_RETRIES, key=None):
+    key = key or image_hash(data)
+    stored = lookup([key], scope, store_path)
+    if key in stored:
+        return with_totals(json.loads(stored[key]))
+
+    messages = estimate_messages(data, mime)
+    for attempt in range(max_retries + 1):
+        answer = query_fn(messages)
+        try:
+            estimate = validate_estimate(extract_json(answer))
+            break
+        except ValueError as e:
+            if attempt == max_retries:
+                raise ValueError(f"the estimate didn't match the schema: {e}")
+            messages = messages + [
+                {"role": "assistant", "content": answer},
+                {"role": "user", "content": [{"type": "text", "text": f"That answer was rejected ({e}). "
+                                              "Reply again with only the JSON object in the requested form."}]},
+            ]
+    save({key: json.dumps(estimate)}, scope, store_path)
+    return with_totals(estimate)
+
+
+def estimate_frame(estimate):
+    frame = pd.DataFrame(estimate["items"], columns=["part", "action", "parts_cost", "labor_cost", "total"])
+    return frame.rename(columns={"parts_cost": "parts ($)", "labor_cost": "labor ($)", "total": "total ($)"})
+
+
+#the estimate as text for the chat, the PDF report and the session history;
+#one "- part (action): $cost" line per item, the form report_pdf itemizes
+def estimate_text(estimate):
+    lines = []
+    if estimate.get("damages"):
+        lines += ["Damages:"] + [f"- {damage}" for damage in estimate["damages"]] + [""]
+    lines.append("Estimate:")
+    for item in estimate["items"]:
+        part = item["part"].replace(":", " -").replace("$", "")
+        lines.append(f"- {part} ({item['action']}): ${item['total']:,.2f}")
+    totals = estimate["totals"]
+    lines.append(f"Total: ${totals['total']:,.2f} (parts ${totals['parts']:,.2f}, labor ${totals['labor']:,.2f})")
+    if estimate.get("notes"):
+        lines += ["", estimate["notes"]]
+    return "\n".join(lines)
@@ -0,0 +1,211 @@
+# Offline repair-shop index built from an OpenStreetMap extract
+#shops are bucketed into a fixed lat/lon grid and stored as flat numpy arrays
+#sorted by grid cell, memory-mapped on load, so a radius or nearest-k query
+#only touches the few cells around the point and never calls Overpass
+#
+#usage: python repair_shop_index.py import extract.osm.pbf --out repair_shop_index
+#       python repair_shop_index.py import overpass_dump.json --out repair_shop_index
+#       python repair_shop_index.py query 40.75 -73.98 --radius 2000 --index repair_shop_index
+#
+#.pbf extracts need the optional `osmium` package (pip install osmium)
+
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from repair_shops import EARTH_RADIUS, haversine, rank_order
+
+INDEX_DIR = os.environ.get("REPAIR_SHOP_INDEX", "repair_shop_index")
+#about 5.5 km north-south; a 5 km radius query touches at most a handful of cells
+CELL_DEG = 0.05
+SHOP_TAG = ("shop", "car_repair")
+TYPES = ["node", "way", "relation"]
+
+
+def cell_of(lats, lons, cell_deg=CELL_DEG):
+    rows = np.floor((np.asarray(lats) + 90) / cell_deg).astype(np.int64)
+    cols = np.floor((np.asarray(lons) + 180) / cell_deg).astype(np.int64)
+    return rows * int(round(360 / cell_deg)) + cols
+
+
+# Import
+#an Overpass `[out:json] ... out center;` dump, ways and relations placed at their center
+def read_overpass_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        elements = json.load(f).get("elements", [])
+    for el in elements:
+        loc = el.get("center", el)
+        tags = el.get("tags", {})
+        if "lat" in loc and tags.get(SHOP_TAG[0]) == SHOP_TAG[1]:
+            yield el["type"], el["id"], tags.get("name", "Unnamed"), loc["lat"], loc["lon"]
+
+
+#nodes as they are, ways at the mean of their node locations; relations are skipped
+def read_pbf(path):
+    try:
+        import osmium
+    except ImportError:
+        raise SystemExit("Reading .pbf extracts needs the osmium package: pip install osmium")
+
+    shops = []
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, n):
+            if n.tags.get(SHOP_TAG[0]) == SHOP_TAG[1] and n.location.valid():
+                shops.append(("node", n.id, n.tags.get("name", "Unnamed"), n.location.lat, n.location.lon))
+
+        def way(self, w):
+            if w.tags.get(SHOP_TAG[0]) != SHOP_TAG[1]:
+                return
+            points = [(nd.location.lat, nd.location.lon) for nd in w.nodes if nd.location.valid()]
+            if points:
+                lat, lon = np.mean(points, axis=0)
+                shops.append(("way", w.id, w.tags.get("name", "Unnamed"), float(lat), float(lon)))
+
+    Handler().apply_file(path, locations=True)
+    return shops
+
+
+def read_extract(path):
+    if path.lower().endswith(".pbf"):
+        return read_pbf(path)
+    return list(read_overpass_json(path))
+
+
+#arrays sorted by grid cell, plus the start offset of every non-empty cell
+def build_index(shops, out_dir=INDEX_DIR, cell_deg=CELL_DEG, source=None):
+    shops = pd.DataFrame(list(shops), columns=["type", "id", "name", "lat", "lon"]).drop_duplicates(["type", "id"])
+    cells = cell_of(shops["lat"], shops["lon"], cell_deg)
+    order = np.argsort(cells, kind="stable")
+    shops, cells = shops.iloc[order].reset_index(drop=True), cells[order]
+    cell_keys, cell_start = np.unique(cells, return_index=True)
+
+    #names as one utf-8 blob and offsets, so they can be memory-mapped too
+    encoded = [str(name).encode("utf-8") for name in shops["name"]]
+    name_end = np.cumsum([len(name) for name in encoded], dtype=np.int64)
+
+    os.makedirs(out_dir, exist_ok=True)
+    arrays = {
+        "lat": shops["lat"].to_numpy(dtype=np.float64),
+        "lon": shops["lon"].to_numpy(dtype=np.float64),
+        "osm_type": shops["type"].map(TYPES.index).to_numpy(dtype=np.uint8),
+        "osm_id": shops["id"].to_numpy(dtype=np.int64),
+        "name_end": name_end,
+        "cell_keys": cell_keys.astype(np.int64),
+        "cell_start": np.append(cell_start, len(shops)).astype(np.int64),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), array)
+    with open(os.path.join(out_dir, "names.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    meta = {"count": len(shops), "cell_deg": cell_deg, "source": source, "built": time.time()}
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+# Queries
+class ShopIndex:
+    def __init__(self, index_dir=INDEX_DIR):
+        with open(os.path.join(index_dir, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        load = lambda name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+        self.lat, self.lon = load("lat"), load("lon")
+        self.name_end = load("name_end")
+        self.cell_keys, self.cell_start = load("cell_keys"), load("cell_start")
+        self.names = np.memmap(os.path.join(index_dir, "names.bin"), dtype=np.uint8, mode="r") \
+            if self.meta["count"] and self.name_end[-1] else np.zeros(0, dtype=np.uint8)
+        self.cell_deg = self.meta["cell_deg"]
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def name(self, i):
+        start = self.name_end[i - 1] if i else 0
+        return bytes(self.names[start:self.name_end[i]]).decode("utf-8")
+
+    #positions of every shop in the cells overlapping the box `radius` meters around the point
+    def candidates(self, lat, lon, radius):
+        dlat = math.degrees(radius / EARTH_RADIUS)
+        dlon = min(dlat / max(math.cos(math.radians(lat)), 1e-6), 180)
+        per_row = int(round(360 / self.cell_deg))
+        row0, row1 = (int((value + 90) // self.cell_deg) for value in (lat - dlat, lat + dlat))
+        col0, col1 = (int((value + 180) // self.cell_deg) for value in (lon - dlon, lon + dlon))
+        if not len(self.cell_keys):
+            return np.zeros(0, dtype=np.int64)
+        keys = np.unique([row * per_row + col % per_row
+                          for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)])
+        found = np.searchsorted(self.cell_keys, keys)
+        found = found[(found < len(self.cell_keys)) & (self.cell_keys[np.minimum(found, len(self.cell_keys) - 1)] == keys)]
+        if not len(found):
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.arange(self.cell_start[i], self.cell_start[i + 1]) for i in found])
+
+    def frame(self, positions, distances):
+        return pd.DataFrame({
+            "name": [self.name(i) for i in positions],
+            "lat": np.asarray(self.lat[positions]),
+            "lon": np.asarray(self.lon[positions]),
+            "distance_m": distances,
+        })
+
+    #shops within `radius` meters (and the optional south/west/north/east box), nearest first
+    def within(self, lat, lon, radius, k=None, bbox=None):
+        positions = self.candidates(lat, lon, radius)
+        lats, lons = np.asarray(self.lat[positions]), np.asarray(self.lon[positions])
+        distances = haversine(lat, lon, lats, lons)
+        keep = distances <= radius
+        if bbox is not None:
+            south, west, north, east = bbox
+            keep &= (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+        positions, distances = positions[keep], distances[keep]
+        order = rank_order(distances, k)
+        return self.frame(positions[order], distances[order])
+
+    #the search radius doubles until it holds k shops, which are then the k nearest
+    def nearest(self, lat, lon, k=10, radius=1000, max_radius=200000):
+        while True:
+            found = self.within(lat, lon, radius, k)
+            if len(found) >= k or radius >= max_radius:
+                return found
+            radius *= 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the offline repair-shop index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("import", help="build the index from an OSM .pbf extract or Overpass JSON dump")
+    build.add_argument("extract", help=".osm.pbf extract or Overpass JSON dump")
+    build.add_argument("--out", default=INDEX_DIR, help="index directory to write")
+    build.add_argument("--cell-deg", type=float, default=CELL_DEG, help="grid cell size in degrees")
+    query = commands.add_parser("query", help="look shops up around a point")
+    query.add_argument("lat", type=float)
+    query.add_argument("lon", type=float)
+    query.add_argument("--radius", type=float, default=2000, help="search radius in meters")
+    query.add_argument("--nearest", type=int, help="return the k nearest shops instead")
+    query.add_argument("--index", default=INDEX_DIR, help="index directory")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        started = time.time()
+        meta = build_index(read_extract(args.extract), args.out, args.cell_deg, source=os.path.basename(args.extract))
+        print(f"indexed {meta['count']:,} shops into {args.out} in {time.time() - started:.2f}s")
+    else:
+        index = ShopIndex(args.index)
+        started = time.time()
+        if args.nearest:
+            found = index.nearest(args.lat, args.lon, args.nearest)
+        else:
+            found = index.within(args.lat, args.lon, args.radius)
+        elapsed = time.time() - started
+        print(found.to_string(index=False))
+        print(f"{len(found)} of {len(index):,} shops in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
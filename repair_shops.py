@@ -0,0 +1,247 @@
+# Nearby car repair shops from OpenStreetMap, cached by map tile
+#shops are fetched per slippy-map tile (zoom 13, a few km across) and kept on
+#disk for a week, so a rerun, a smaller radius or a nearby user reads tiles
+#that are already there and only the distance filter runs again. Overpass is
+#asked for tab-separated rows of just the fields used, parsed line by line into
+#columns. When every Overpass server is failing, expired tiles are used rather
+#than nothing. When an offline index has been built (repair_shop_index.py) it
+#is used instead of Overpass
+
+import json
+import math
+import os
+import time
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from overpass_client import OverpassUnavailable, default_client
+
+TILE_DIR = ".overpass_cache"
+TILE_ZOOM = 13
+TILE_TTL = 7 * 24 * 3600
+#server-side limit, kept under the client's read timeout
+QUERY_TIMEOUT = 25
+EARTH_RADIUS = 6371008.8
+
+#shop categories by OSM tag, any of them can be asked for in one query
+CATEGORIES = {
+    "car_repair": ("shop", "car_repair"),
+    "tyres": ("shop", "tyres"),
+    "car_parts": ("shop", "car_parts"),
+    "car_wash": ("amenity", "car_wash"),
+}
+DEFAULT_CATEGORIES = ("car_repair",)
+#name last, so a stray tab inside a name can't shift the other columns
+CSV_FIELDS = ["::type", "::id", "::lat", "::lon", "shop", "amenity", "name"]
+#the header line Overpass puts first; an answer without it was cut off or is an error
+CSV_HEADER = "\t".join(field.replace("::", "@") for field in CSV_FIELDS)
+COLUMNS = ["id", "name", "lat", "lon", "category"]
+
+
+def tile_xy(lat, lon, zoom=TILE_ZOOM):
+    n = 2 ** zoom
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+#(south, west, north, east) of a tile
+def tile_bounds(x, y, zoom=TILE_ZOOM):
+    n = 2 ** zoom
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, x / n * 360 - 180, north, (x + 1) / n * 360 - 180
+
+
+#every tile touching the box `radius` meters around the point
+def tiles_around(lat, lon, radius, zoom=TILE_ZOOM):
+    dlat = math.degrees(radius / EARTH_RADIUS)
+    dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    x0, y0 = tile_xy(lat + dlat, lon - dlon, zoom)
+    x1, y1 = tile_xy(lat - dlat, lon + dlon, zoom)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+#vectorized tile_xy for arrays of points
+def tiles_of(lats, lons, zoom=TILE_ZOOM):
+    n = 2 ** zoom
+    lats = np.clip(np.asarray(lats, dtype=float), -85.0511, 85.0511)
+    xs = ((np.asarray(lons, dtype=float) + 180) / 360 * n).astype(np.int64)
+    ys = ((1 - np.arcsinh(np.tan(np.radians(lats))) / np.pi) / 2 * n).astype(np.int64)
+    return np.clip(xs, 0, n - 1), np.clip(ys, 0, n - 1)
+
+
+def category_key(categories):
+    return "+".join(sorted(categories))
+
+
+def tile_path(x, y, zoom=TILE_ZOOM, tile_dir=TILE_DIR):
+    return os.path.join(tile_dir, str(zoom), str(x), f"{y}.json")
+
+
+#a tile's shops as column lists; None when it was never fetched or is older than `ttl`
+def read_tile(x, y, zoom=TILE_ZOOM, tile_dir=TILE_DIR, ttl=TILE_TTL):
+    path = tile_path(x, y, zoom, tile_dir)
+    try:
+        with open(path, "r") as f:
+            tile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - tile["fetched"] > ttl:
+        return None
+    return tile["columns"]
+
+
+def write_tile(x, y, columns, zoom=TILE_ZOOM, tile_dir=TILE_DIR):
+    path = tile_path(x, y, zoom, tile_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    #written under a temporary name so another session never reads half a tile
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"fetched": time.time(), "columns": columns}, f)
+    os.replace(tmp_path, path)
+
+
+#one nwr selector per category over the box, answered as tab-separated rows of
+#CSV_FIELDS only, after a header line; `out center qt` gives ways and relations a
+#single point and skips sorting by id
+def build_query(bbox, categories=DEFAULT_CATEGORIES, timeout=QUERY_TIMEOUT):
+    box = ",".join(f"{value:.6f}" for value in bbox)
+    selectors = "".join(f'nwr["{key}"="{value}"]({box});' for key, value in (CATEGORIES[c] for c in categories))
+    return f'[out:csv({",".join(CSV_FIELDS)};true;"\\t")][timeout:{timeout}];({selectors});out center qt;'
+
+
+#streams rows straight into column lists, no per-shop dicts. A timeout or memory
+#error arrives as a remark or an error page instead of rows, and a cut-off answer
+#as a missing header or a broken last line; all of them raise rather than being
+#read as "no shops here", which would be cached for a week
+def parse_rows(lines):
+    by_tag = {tag: category for category, tag in CATEGORIES.items()}
+    columns = {name: [] for name in COLUMNS}
+    lines = iter(lines)
+    header = next(lines, "").strip()
+    if header != CSV_HEADER:
+        raise OverpassUnavailable(f"Overpass didn't answer with shop rows: {header[:200]!r}")
+    for line in lines:
+        if not line.strip():
+            continue
+        fields = line.split("\t", len(CSV_FIELDS) - 1)
+        if len(fields) < len(CSV_FIELDS) or "runtime error" in line or "runtime remark" in line:
+            raise OverpassUnavailable(f"Overpass answer is incomplete: {line[:200]!r}")
+        osm_type, osm_id, lat, lon, shop, amenity, name = fields
+        if not lat:
+            continue
+        columns["id"].append(f"{osm_type}/{osm_id}")
+        columns["name"].append(name or "Unnamed")
+        columns["lat"].append(float(lat))
+        columns["lon"].append(float(lon))
+        columns["category"].append(by_tag.get(("shop", shop)) or by_tag.get(("amenity", amenity), ""))
+    return columns
+
+
+def fetch_shops(bbox, categories=DEFAULT_CATEGORIES):
+    text = default_client().post(build_query(bbox, categories))
+    return parse_rows(text.splitlines())
+
+
+#the missing tiles are fetched with one bbox query over the block they span, then
+#each of them is stored, empty ones included; other tiles in the block are left alone
+def fill_tiles(tiles, categories=DEFAULT_CATEGORIES, zoom=TILE_ZOOM, tile_dir=TILE_DIR):
+    xs, ys = [x for x, _ in tiles], [y for _, y in tiles]
+    south, west, _, _ = tile_bounds(min(xs), max(ys), zoom)
+    _, _, north, east = tile_bounds(max(xs), min(ys), zoom)
+    shops = pd.DataFrame(fetch_shops((south, west, north, east), categories), columns=COLUMNS)
+    shops["x"], shops["y"] = tiles_of(shops["lat"], shops["lon"], zoom)
+    groups = shops.groupby(["x", "y"])
+    by_tile = {}
+    for x, y in tiles:
+        tile = groups.get_group((x, y)) if (x, y) in groups.groups else shops.iloc[:0]
+        by_tile[(x, y)] = {name: tile[name].tolist() for name in COLUMNS}
+        write_tile(x, y, by_tile[(x, y)], zoom, tile_dir)
+    return by_tile
+
+
+def haversine(lat, lon, lats, lons):
+    lat, lon, lats, lons = map(np.radians, (lat, lon, np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+#positions of `distances` nearest first; with k only the k nearest are partitioned
+#out and sorted, so a dense area doesn't pay for sorting every shop
+def rank_order(distances, k=None):
+    order = np.arange(len(distances))
+    if k is not None and k < len(order):
+        order = np.argpartition(distances, k)[:k]
+    return order[np.argsort(distances[order], kind="stable")]
+
+
+#every shop's distance from the point in one numpy pass, then the optional
+#bounding box (south, west, north, east), radius and nearest-k filters
+def rank_shops(shops, lat, lon, radius=None, k=None, bbox=None):
+    lats = shops["lat"].to_numpy(dtype=float)
+    lons = shops["lon"].to_numpy(dtype=float)
+    keep = np.ones(len(shops), dtype=bool)
+    if bbox is not None:
+        south, west, north, east = bbox
+        keep &= (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+    positions = np.flatnonzero(keep)
+    distances = haversine(lat, lon, lats[positions], lons[positions])
+    if radius is not None:
+        positions, distances = positions[distances <= radius], distances[distances <= radius]
+    order = rank_order(distances, k)
+    ranked = shops.iloc[positions[order]].reset_index(drop=True)
+    ranked["distance_m"] = distances[order]
+    return ranked
+
+
+#reopened only when the index is rebuilt
+@lru_cache(maxsize=2)
+def open_index(index_dir, built):
+    from repair_shop_index import ShopIndex
+    return ShopIndex(index_dir)
+
+
+def offline_index(index_dir=None):
+    from repair_shop_index import INDEX_DIR
+    meta_path = os.path.join(index_dir or INDEX_DIR, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    return open_index(index_dir or INDEX_DIR, os.path.getmtime(meta_path))
+
+
+#shops within `radius` meters, nearest first with their distance; tiles are loaded for
+#`prefetch_radius` (e.g. the slider's maximum) so that any smaller radius afterwards
+#is answered without a network call
+def nearby_shops(lat, lon, radius, prefetch_radius=None, k=None, bbox=None,
+                 categories=DEFAULT_CATEGORIES, tile_dir=TILE_DIR):
+    index = offline_index()
+    if index is not None:
+        return index.within(lat, lon, radius, k, bbox).assign(category="car_repair")
+
+    #each set of categories keeps its own tiles
+    tile_dir = os.path.join(tile_dir, category_key(categories))
+    tiles = tiles_around(lat, lon, max(radius, prefetch_radius or 0))
+    found = {tile: read_tile(*tile, tile_dir=tile_dir) for tile in tiles}
+    missing = [tile for tile, columns in found.items() if columns is None]
+    stale = False
+    if missing:
+        try:
+            fetched = fill_tiles(missing, categories, tile_dir=tile_dir)
+        except OverpassUnavailable:
+            fetched = {tile: read_tile(*tile, tile_dir=tile_dir, ttl=float("inf")) for tile in missing}
+            if all(columns is None for columns in fetched.values()):
+                raise
+            fetched = {tile: columns or {name: [] for name in COLUMNS} for tile, columns in fetched.items()}
+            stale = True
+        found.update({tile: fetched[tile] for tile in missing})
+
+    df = pd.DataFrame({name: [value for columns in found.values() for value in columns[name]] for name in COLUMNS})
+    df = df.drop_duplicates("id")[["name", "lat", "lon", "category"]]
+    ranked = rank_shops(df, lat, lon, radius, k, bbox)
+    #set when some of the shops come from expired tiles
+    ranked.attrs["stale"] = stale
+    return ranked
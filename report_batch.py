@@ -0,0 +1,88 @@
+# Batch export of many analyses as one PDF or a ZIP of PDFs
+#every analysis is rendered to its own file on disk by a pool of worker
+#processes (report_pdf's engine is pure python, so threads wouldn't overlap),
+#started with "spawn" since this runs inside the threaded Streamlit server, where a
+#forked child can inherit a lock another thread holds and wait on it forever.
+#The archive is then put together file by file in a temporary file, and each
+#rendered PDF is deleted as soon as it's in, so at most one item's bytes are
+#in memory at a time
+
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from PyPDF2 import PdfWriter
+
+from report_pdf import write_report
+
+MAX_EXPORT_WORKERS = 4
+FORMATS = {"pdf": "application/pdf", "zip": "application/zip"}
+
+
+#numbered in export order, with the title made safe for a file name in the archive
+def item_file_name(position, item):
+    title = re.sub(r"[^\w.-]+", "_", item.get("title") or "analysis").strip("_")[:60]
+    return f"{position + 1:03d}_{title}.pdf"
+
+
+#run in a worker process; only the path comes back, not the PDF
+def render_item(item, path):
+    with open(path, "wb") as f:
+        write_report(f, item["content"], item.get("title") or "Analysis Result", item.get("image"), item.get("shops"))
+    return path
+
+
+#paths of the rendered items in order; pool.map hands them back in order while
+#the later ones are still rendering
+def render_files(items, workdir, max_workers=MAX_EXPORT_WORKERS):
+    paths = [os.path.join(workdir, item_file_name(i, item)) for i, item in enumerate(items)]
+    workers = min(max_workers, len(items), os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            yield from pool.map(render_item, items, paths)
+    else:
+        yield from map(render_item, items, paths)
+
+
+#PDFs are already compressed, so they're stored in the archive as they are
+def write_zip(paths, out):
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as archive:
+        for path in paths:
+            archive.write(path, os.path.basename(path))
+            os.remove(path)
+
+
+#one document with a bookmark per analysis
+def write_merged(paths, out, titles):
+    writer = PdfWriter()
+    for path, title in zip(paths, titles):
+        with open(path, "rb") as f:
+            writer.append(f, outline_item=title)
+        os.remove(path)
+    writer.write(out)
+
+
+#the export as a file on disk, opened for reading; the caller closes it and the
+#file goes away with its temporary directory once it's closed
+def export_reports(items, fmt="zip", max_workers=MAX_EXPORT_WORKERS):
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    workdir = tempfile.mkdtemp(prefix="report_export_")
+    try:
+        out_path = os.path.join(workdir, f"analyses.{fmt}")
+        with open(out_path, "wb") as out:
+            paths = render_files(items, workdir, max_workers)
+            if fmt == "zip":
+                write_zip(paths, out)
+            else:
+                write_merged(paths, out, [item.get("title") or "Analysis Result" for item in items])
+        export = open(out_path, "rb")
+    finally:
+        #an open file stays readable after its directory entry is gone (POSIX);
+        #elsewhere the directory is left for the OS to clean up
+        shutil.rmtree(workdir, ignore_errors=True)
+    return export
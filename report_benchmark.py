@@ -0,0 +1,91 @@
+# Benchmark for the PDF report engine
+#renders synthetic analysis text of growing length with the old single-string
+#FPDF path and with report_pdf.py, once with Windows-1252 text (core font) and
+#once with text that needs the embedded Unicode font, timing each and tracing
+#peak memory, and writes the results to JSON
+#
+#usage: python report_benchmark.py --lines 100 1000 5000 --output bench_report.json
+
+import argparse
+import json
+import platform
+import sys
+from datetime import datetime
+
+from fpdf import FPDF
+
+from report_pdf import clean_text, find_font, render_report
+from script_tools import measure
+
+DEFAULT_LINES = [100, 1000, 5000]
+ENGINES = ["fpdf", "report", "unicode"]
+#a typical estimate line, with the punctuation the model likes
+LINE = "- Front bumper replacement — the “OEM” part, paint and blending: $1,200 (labor included)."
+#the same line with characters outside Windows-1252, so the TTF font is needed
+UNICODE_LINE = LINE.replace("part", "part ≈ Stoßfänger / бампер")
+
+
+#the report as download.py built it before report_pdf.py: core font, the whole
+#document kept as one string and encoded at the end
+def legacy_pdf(content, title="Analysis Result"):
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Times", size=12)
+    pdf.cell(200, 10, txt=title, ln=True, align="C")
+    pdf.ln(10)
+    pdf.multi_cell(0, 10, content)
+    return pdf.output(dest="S").encode("latin1")
+
+
+def run_benchmarks(lines, engines, repeat, memory=True):
+    results = []
+    for n_lines in lines:
+        text = "\n".join(f"{i + 1}. {LINE}" for i in range(n_lines))
+        unicode_text = "\n".join(f"{i + 1}. {UNICODE_LINE}" for i in range(n_lines))
+        functions = {
+            #the old path raises on anything outside Latin-1, so it gets folded text
+            "fpdf": lambda: legacy_pdf(clean_text(text)),
+            "report": lambda: render_report(text),
+            "unicode": lambda: render_report(unicode_text),
+        }
+        for engine in engines:
+            seconds, peak, pdf = measure(functions[engine], repeat, memory)
+            size = len(pdf)
+            result = {
+                "engine": engine,
+                "lines": n_lines,
+                "seconds": round(seconds, 6),
+                "pdf_kb": round(size / 1024, 1),
+                "peak_mb": round(peak / 2 ** 20, 3) if peak is not None else None,
+            }
+            results.append(result)
+            memory_note = f"{result['peak_mb']:10.1f}MB peak" if peak is not None else ""
+            print(f"{n_lines:>8} lines {engine:<8} {seconds:10.4f}s {result['pdf_kb']:10.1f}KB {memory_note}", flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PDF report engine against the old FPDF path.")
+    parser.add_argument("--lines", nargs="+", type=int, default=DEFAULT_LINES, help="lines of analysis text per report")
+    parser.add_argument("--engines", nargs="+", default=ENGINES, choices=ENGINES, help="renderers to time")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per size, the best one is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the extra traced run for peak memory")
+    parser.add_argument("--output", default="bench_report.json", help="where to write the results")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.lines, args.engines, args.repeat, memory=not args.no_memory)
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "font": find_font(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+# PDF reports of analysis results, built once per distinct content
+#a report is keyed by a hash of everything that goes into it and rendered on a
+#background thread the first time that content is seen, so reruns (and other
+#sessions with the same result) get the finished bytes back instead of rebuilding
+#the document
+#
+#text that fits the Windows-1252 set (English, with curly quotes and dashes) is
+#set in the core Times font, which needs nothing embedded and is the fast path.
+#Anything else is set in an embedded Unicode TTF font (REPORT_FONT, or the DejaVu
+#Sans shipped in fonts/); characters the font has no glyph for (emoji, mostly)
+#become "?", as does everything outside Windows-1252 if no TTF font can be found,
+#which is warned about. Long reports
+#are streamed: each page is compressed and written to the output as soon as it's
+#finished, so only the page being laid out is held in memory
+
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+import warnings
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+
+from fpdf import FPDF
+import fpdf.fpdf as fpdf_module
+from PIL import Image
+
+MAX_REPORTS = 32
+FONT_PATHS = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts", "DejaVuSans.ttf"),
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+]
+#thumbnail size in mm on the page, and in pixels for the embedded JPEG
+THUMBNAIL_MM = 80
+THUMBNAIL_PX = 640
+LINE_MM = 7
+#analysis text longer than this is streamed page by page instead of built in memory
+STREAM_CHARS = 200_000
+#parsed TTF fonts are pickled here; fpdf's default puts them next to the TTF,
+#which usually isn't writable
+FONT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "fpdf_fonts")
+
+_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="report")
+_reports = OrderedDict()
+_lock = threading.Lock()
+_font_lock = threading.Lock()
+
+
+# Fonts
+@lru_cache(maxsize=1)
+def find_font():
+    for path in [os.environ.get("REPORT_FONT")] + FONT_PATHS:
+        if path and os.path.exists(path):
+            return path
+    #matplotlib ships DejaVu Sans, when it happens to be installed
+    try:
+        import matplotlib
+        path = os.path.join(matplotlib.get_data_path(), "fonts", "ttf", "DejaVuSans.ttf")
+        if os.path.exists(path):
+            return path
+    except ImportError:
+        pass
+    #cached, so this is said once per process
+    warnings.warn("no Unicode TTF font found (fonts/DejaVuSans.ttf is missing and REPORT_FONT isn't set); "
+                  "report text outside Windows-1252 will print as '?'")
+    return None
+
+
+#code points the font has a glyph for; fpdf 1.7.2 only handles the BMP
+@lru_cache(maxsize=4)
+def font_chars(path):
+    from fontTools.ttLib import TTFont
+    with TTFont(path, lazy=True) as font:
+        return frozenset(code for code in font.getBestCmap() if code <= 0xFFFF)
+
+
+#fpdf only reads its font cache settings as module globals, so they're set just
+#around add_font and put back afterwards instead of changed for the whole process
+@contextmanager
+def font_cache():
+    with _font_lock:
+        saved = fpdf_module.FPDF_CACHE_MODE, fpdf_module.FPDF_CACHE_DIR
+        os.makedirs(FONT_CACHE_DIR, exist_ok=True)
+        fpdf_module.FPDF_CACHE_MODE, fpdf_module.FPDF_CACHE_DIR = 2, FONT_CACHE_DIR
+        try:
+            yield
+        finally:
+            fpdf_module.FPDF_CACHE_MODE, fpdf_module.FPDF_CACHE_DIR = saved
+
+
+#the core fonts are WinAnsi encoded, so Windows-1252 text only needs its bytes
+#passed on as Latin-1 characters
+def fits_core(*texts):
+    try:
+        for text in texts:
+            str(text).encode("cp1252")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+#one translate() over the text with a table built from its distinct characters,
+#so a long answer isn't split into a list of one-character strings
+def clean_text(text, chars=None):
+    text = str(text)
+    if chars is None:
+        return text.encode("cp1252", "replace").decode("latin1")
+    missing = {ord(c): "?" for c in set(text) if ord(c) not in chars and c not in "\n\t"}
+    return text.translate(missing) if missing else text
+
+
+# Estimate lines
+#"- Front bumper replacement: $1,200" style lines of the model's answer, one
+#amount each as the prompt asks for; a "total" line is left out and summed instead
+ESTIMATE_LINE = re.compile(r"^[\s*#>\-\u2022\d.)]*(?P<item>[^:$\n]{2,80}?)[*\s]*[:\-\u2013\u2014]\s*[*\s]*\$\s?(?P<cost>\d[\d,]*(?:\.\d+)?)[*\s]*$", re.M)
+
+
+def estimate_items(text):
+    rows = []
+    #only lines that end in an amount can match, the rest would just backtrack
+    for line in (text or "").splitlines():
+        if "$" not in line or not line.rstrip(" *")[-1:].isdigit():
+            continue
+        match = ESTIMATE_LINE.match(line)
+        if match is None:
+            continue
+        item = match.group("item").strip(" *")
+        if "total" not in item.lower():
+            rows.append((item, float(match.group("cost").replace(",", ""))))
+    return rows
+
+
+# Rendering
+#the document itself, written to a file as it grows instead of kept as a string;
+#fpdf only ever appends to it and asks for its length
+class FileBuffer:
+    def __init__(self, out):
+        self.out = out
+        self.size = 0
+
+    def __iadd__(self, s):
+        data = s.encode("latin1")
+        self.out.write(data)
+        self.size += len(data)
+        return self
+
+    def __len__(self):
+        return self.size
+
+
+#the code points a TTF font embeds; fpdf appends one for every character it
+#prints and checks membership per glyph when writing the font, which turns
+#quadratic on long reports, so repeats are dropped and lookups go to a set
+class GlyphSubset(list):
+    def __init__(self, codes=()):
+        super().__init__()
+        self.seen = set()
+        for code in codes:
+            self.append(code)
+
+    def append(self, code):
+        if code not in self.seen:
+            self.seen.add(code)
+            super().append(code)
+
+    def __contains__(self, code):
+        return code in self.seen
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self.seen = set(self)
+
+
+#the report layout on a plain FPDF document, built in memory and written out at the end
+class ReportPDF(FPDF):
+    def __init__(self, font_path=None):
+        super().__init__()
+        self.chars = None
+        self.family = "Times"
+        if font_path:
+            with font_cache():
+                self.add_font("Report", "", font_path, uni=True)
+            self.fonts["report"]["subset"] = GlyphSubset(self.fonts["report"]["subset"])
+            self.chars = font_chars(font_path)
+            self.family = "Report"
+
+    def text(self, s):
+        return clean_text(s, self.chars)
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font(self.family, size=9)
+        self.cell(0, 10, f"Page {self.page_no()}", align="C")
+
+    def heading(self, text, size=13):
+        self.set_font(self.family, size=size)
+        self.ln(4)
+        self.cell(0, LINE_MM + 1, self.text(text), ln=True)
+        self.set_font(self.family, size=11)
+
+    #the longest prefix of the text that fits a table cell `width` mm wide
+    def fit(self, text, width):
+        text = self.text(text)
+        while text and self.get_string_width(text) > width - 2:
+            text = text[:-1]
+        return text
+
+    def table(self, header, rows, widths, align):
+        self.set_font(self.family, size=10)
+        for text, width, a in zip(header, widths, align):
+            self.cell(width, LINE_MM, self.fit(text, width), border=1, align=a)
+        self.ln()
+        for row in rows:
+            for text, width, a in zip(row, widths, align):
+                self.cell(width, LINE_MM, self.fit(text, width), border=1, align=a)
+            self.ln()
+        self.set_font(self.family, size=11)
+
+    def finish(self, out):
+        out.write(self.output(dest="S").encode("latin1"))
+
+
+#fpdf keeps every page as a string until output(); here each page's objects are
+#written out when the page ends (objects 3, 4 for page 1, 5, 6 for page 2, the
+#numbering fpdf itself uses) and only the page tree is left for the end. This
+#replaces fpdf's own page writing, so it's tied to fpdf 1.7.2 (requirements.txt)
+#and only used for reports too long to build in memory
+class StreamingPDF(ReportPDF):
+    def __init__(self, out, font_path=None):
+        super().__init__(font_path)
+        self.buffer = FileBuffer(out)
+        self._out("%PDF-" + self.pdf_version)
+
+    def _putheader(self):
+        pass
+
+    def _endpage(self):
+        super()._endpage()
+        n = self.page
+        w_pt, h_pt = (self.fw_pt, self.fh_pt) if self.def_orientation == "P" else (self.fh_pt, self.fw_pt)
+        self._newobj()
+        self._out("<</Type /Page")
+        self._out("/Parent 1 0 R")
+        if n in self.orientation_changes:
+            self._out("/MediaBox [0 0 %.2f %.2f]" % (h_pt, w_pt))
+        self._out("/Resources 2 0 R")
+        self._out("/Contents " + str(self.n + 1) + " 0 R>>")
+        self._out("endobj")
+        content = self.pages[n].encode("latin1")
+        if self.compress:
+            content = zlib.compress(content)
+        self._newobj()
+        self._out("<<" + ("/Filter /FlateDecode " if self.compress else "") + "/Length " + str(len(content)) + ">>")
+        self._putstream(content)
+        self._out("endobj")
+        self.pages[n] = ""
+
+    def _putpages(self):
+        w_pt, h_pt = (self.fw_pt, self.fh_pt) if self.def_orientation == "P" else (self.fh_pt, self.fw_pt)
+        self.offsets[1] = len(self.buffer)
+        self._out("1 0 obj")
+        self._out("<</Type /Pages")
+        self._out("/Kids [" + "".join(f"{3 + 2 * i} 0 R " for i in range(self.page)) + "]")
+        self._out("/Count " + str(self.page))
+        self._out("/MediaBox [0 0 %.2f %.2f]" % (w_pt, h_pt))
+        self._out(">>")
+        self._out("endobj")
+
+    def finish(self, out):
+        self.close()
+
+
+#the image as a JPEG thumbnail on disk, since fpdf only embeds image files
+def thumbnail_file(image):
+    picture = Image.open(io.BytesIO(image)).convert("RGB")
+    picture.thumbnail((THUMBNAIL_PX, THUMBNAIL_PX))
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+        picture.save(f, "JPEG", quality=80)
+    return f.name, picture.size
+
+
+#the report written to `out` (any binary file): title, the image thumbnail, the
+#itemized estimate found in the text, the nearby shops as (name, distance in m)
+#pairs, then the full analysis text
+def write_report(out, content, title="Analysis Result", image=None, shops=None):
+    content = str(content)
+    font_path = None if fits_core(title, content, *(name for name, _ in shops or [])) else find_font()
+    pdf = StreamingPDF(out, font_path) if len(content) > STREAM_CHARS else ReportPDF(font_path)
+    pdf.set_auto_page_break(True, margin=20)
+    pdf.add_page()
+    pdf.set_font(pdf.family, size=16)
+    pdf.cell(0, 10, pdf.text(title), ln=True, align="C")
+    pdf.ln(4)
+
+    thumbnail = None
+    try:
+        if image:
+            thumbnail, (w, h) = thumbnail_file(image)
+            pdf.image(thumbnail, x=(pdf.w - THUMBNAIL_MM) / 2, w=THUMBNAIL_MM, h=THUMBNAIL_MM * h / w)
+
+        items = estimate_items(content)
+        if items:
+            pdf.heading("Repair estimate")
+            rows = [(item, f"${cost:,.2f}") for item, cost in items]
+            rows.append(("Total", f"${sum(cost for _, cost in items):,.2f}"))
+            pdf.table(("Item", "Cost"), rows, (140, 40), ("L", "R"))
+
+        if shops:
+            pdf.heading("Nearby repair shops")
+            rows = [(name, f"{meters / 1609.344:.2f} mi") for name, meters in shops]
+            pdf.table(("Shop", "Distance"), rows, (140, 40), ("L", "R"))
+
+        pdf.heading("Analysis")
+        #one multi_cell for the whole text, it breaks on "\n" itself
+        pdf.multi_cell(0, LINE_MM, pdf.text(content))
+        pdf.finish(out)
+    finally:
+        if thumbnail:
+            os.remove(thumbnail)
+    return out
+
+
+def render_report(content, title="Analysis Result", image=None, shops=None):
+    #spills to disk past a few MB, so a huge report doesn't sit in memory twice
+    with tempfile.SpooledTemporaryFile(max_size=4 * 1024 * 1024) as out:
+        write_report(out, content, title, image, shops)
+        out.seek(0)
+        return out.read()
+
+
+def report_key(content, title, image=None, shops=None):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (title, content):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(image or b"")
+    digest.update(repr(shops or []).encode("utf-8"))
+    return digest.hexdigest()
+
+
+#a render that raised is dropped, so the next request for that content tries again
+#instead of getting the same exception back from the cache
+def forget_failed(key, future):
+    if future.cancelled() or future.exception() is not None:
+        with _lock:
+            if _reports.get(key) is future:
+                del _reports[key]
+
+
+#starts rendering in the background unless this content already has a report;
+#call it as soon as a result exists so the PDF is ready by the time it's needed
+def start_report(content, title="Analysis Result", image=None, shops=None):
+    shops = [(str(name), round(float(meters))) for name, meters in shops] if shops else None
+    key = report_key(content, title, image, shops)
+    with _lock:
+        future = _reports.get(key)
+        started = future is None
+        if started:
+            future = _pool.submit(render_report, content, title, image, shops)
+            _reports[key] = future
+            while len(_reports) > MAX_REPORTS:
+                _reports.popitem(last=False)
+        else:
+            _reports.move_to_end(key)
+    #outside the lock: a future that's already done runs the callback right here
+    if started:
+        future.add_done_callback(partial(forget_failed, key))
+    return future
+
+
+#the PDF as bytes, waiting for the background render if it's still running
+def create_pdf(content, title="Analysis Result", image=None, shops=None):
+    return start_report(content, title, image, shops).result()
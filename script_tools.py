@@ -0,0 +1,38 @@
+# Helpers shared by the command-line scripts
+
+import sys
+import time
+import tracemalloc
+
+
+#best wall time over `repeat` runs, then one extra run under tracemalloc for the peak
+#(tracing slows python down a lot, so it never overlaps with the timed runs); the
+#last run's return value comes back too
+def measure(fn, repeat, memory=True):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    if not memory:
+        return min(times), None, result
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak, result
+
+
+#a progress(done, total) callback that rewrites one stderr line at most once a second,
+#so piping the summary stays clean; `template` gets done, total and rate (per second)
+def progress_printer(started, template):
+    last = [0.0]
+
+    def show(done, total):
+        now = time.time()
+        if now - last[0] < 1 and done < total:
+            return
+        last[0] = now
+        rate = done / max(now - started, 1e-9)
+        print("\r" + template.format(done=done, total=total, rate=rate), end="", file=sys.stderr)
+    return show